@@ -0,0 +1,115 @@
+"""
+Copyright [2019-2020] EMBL-European Bioinformatics Institute
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import json
+import os
+import threading
+"""Append-only journal of the OSID idSets, allocations and session rows of a run, replayed to resume a failed run"""
+
+
+class AllocationJournal:
+    """
+    One JSON record per line, each record is flushed and synced before the run goes on. Without a path
+    nothing is recorded. With resume the records of the previous run are loaded and new records are
+    appended, otherwise the journal is started again. A torn last line from a crash is ignored.
+
+    id_set: the source ids given the gene ids of an idSet, written before the transcripts are requested
+    transcripts: the generated ids of an idSet after the transcripts were allocated
+    session: the session row of an idSet
+    session_records: stable ids with the id of the record this run inserted for them
+    session_rows: stable ids with their record and action rows written to the session database
+    """
+
+    def __init__(self, path=None, resume=False):
+        self.path = path
+        self.id_sets = dict()
+        self.sessions = dict()
+        self.written_records = dict()
+        self.written_stable_ids = set()
+        self.restored_source_ids = set()
+        self._lock = threading.Lock()
+        self._handle = None
+        if not self.path:
+            return
+        if resume and os.path.exists(self.path):
+            self._load()
+            self._handle = open(self.path, 'a')
+        else:
+            self._handle = open(self.path, 'w')
+
+    def _load(self):
+        """Replay the records, a torn last record is cut off so the appended records start on a new line"""
+        with open(self.path, 'rb') as file:
+            lines = file.readlines()
+        complete_size = 0
+        for line_number, line in enumerate(lines):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                if line_number == len(lines) - 1:
+                    print('Ignoring the incomplete last record of journal {}'.format(self.path))
+                    os.truncate(self.path, complete_size)
+                    return
+                raise
+            complete_size += len(line)
+            self._replay(record)
+        if lines and not lines[-1].endswith(b'\n'):
+            with open(self.path, 'ab') as file:
+                file.write(b'\n')
+
+    def _replay(self, record):
+        if record['record'] == 'id_set':
+            self.id_sets[record['id_set_id']] = {'genes': record['genes'], 'generated_ids': None}
+            self.restored_source_ids.update(source_id for source_id, _ in record['genes'])
+        elif record['record'] == 'transcripts':
+            self.id_sets[record['id_set_id']]['generated_ids'] = record['generated_ids']
+        elif record['record'] == 'session':
+            self.sessions[record['osid_id']] = record['session_id']
+        elif record['record'] == 'session_records':
+            self.written_records.update(record['record_ids'])
+        elif record['record'] == 'session_rows':
+            self.written_stable_ids.update(record['stable_ids'])
+
+    def _append(self, record):
+        if self._handle is None:
+            return
+        with self._lock:
+            self._handle.write(json.dumps(record) + '\n')
+            self._handle.flush()
+            os.fsync(self._handle.fileno())
+
+    def is_restored(self, source_id):
+        return source_id in self.restored_source_ids
+
+    def record_id_set(self, id_set_id, genes):
+        """genes is a list of (source id, allocated gene id)"""
+        self._append({'record': 'id_set', 'id_set_id': id_set_id, 'genes': [list(gene) for gene in genes]})
+
+    def record_transcripts(self, id_set_id, generated_ids):
+        self._append({'record': 'transcripts', 'id_set_id': id_set_id, 'generated_ids': generated_ids})
+
+    def record_session(self, osid_id, session_id):
+        self._append({'record': 'session', 'osid_id': osid_id, 'session_id': session_id})
+
+    def record_session_records(self, record_ids):
+        """record_ids is a dict of stable id to the record id inserted for it"""
+        self._append({'record': 'session_records', 'record_ids': record_ids})
+
+    def record_session_rows(self, stable_ids):
+        self._append({'record': 'session_rows', 'stable_ids': stable_ids})
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
@@ -12,33 +12,159 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from allocation_service.genomic_features import ProteinCodingGene
+from allocation_service import translation_map
+from allocation_service.allocation_journal import AllocationJournal
+from allocation_service.run_report import RunReport
+from allocation_service.osid_service import OSIDServiceError
 """module for classes handling annotation events. An event is a change to a locus with one or more overlapping genes"""
 
 
 class EventCollection:
     event_types = {'new_gene', 'change_gene', 'lost_iso_form', 'gain_iso_form', 'split_gene', 'merge_gene'}
+    coalesce_edit_only_events = True
 
-    def __init__(self, organism_name, event_connection, stable_id_service):
+    def __init__(self, organism_name, event_connection, stable_id_service, max_concurrency=1,
+                 allocation_chunk_size=0, allocation_chunk_workers=1, journal=None, report=None):
         self.organism_name = organism_name
         self.event_connection = event_connection
         self.stable_id_service = stable_id_service
+        self.max_concurrency = max_concurrency
+        self.allocation_chunk_size = allocation_chunk_size
+        self.allocation_chunk_workers = allocation_chunk_workers
+        self.journal = journal or AllocationJournal()
+        self.report = report or RunReport()
         self.annotation_event_list = list()
         self.feature_index = dict()
 
     def create(self):
-        for event_type in self.event_types:
+        """
+        Events are set up and their ancestors updated one event type at a time in a fixed order,
+        so feature_index is the same on every run. Only the OSID requests run concurrently
+        when max_concurrency is above one, each event type allocates to its own created genes.
+        Genes allocated by a resumed journal are restored before any new idSet is requested.
+        """
+        for event_type in sorted(self.event_types):
             if event_type == 'change_gene' or event_type == 'lost_iso_form' or event_type == 'gain_iso_form':
                 annotation_event = EditOnlyEvent(event_type, self.organism_name,
-                                                 self.event_connection, self.stable_id_service)
+                                                 self.event_connection, self.stable_id_service,
+                                                 journal=self.journal)
             else:
                 annotation_event = CreateGeneModelEvent(event_type, self.organism_name,
-                                                        self.event_connection, self.stable_id_service)
+                                                        self.event_connection, self.stable_id_service,
+                                                        self.allocation_chunk_size, self.allocation_chunk_workers,
+                                                        self.journal)
 
-            annotation_event.setup(self.feature_index)
-            annotation_event.get_new_stable_ids()
-            annotation_event.update_ancestors()
+            with self.report.stage('event_setup.' + event_type):
+                annotation_event.setup(self.feature_index)
+            self.report.count('events', len(annotation_event.event_list))
+            self.report.count('created_genes', len(annotation_event.created_genes))
             self.annotation_event_list.append(annotation_event)
+        self.report.count('features', len(self.feature_index))
+        with self.report.stage('journal_restore'):
+            self._restore_from_journal()
+
+        allocation_tasks = list()
+        edit_only_events = list()
+        for annotation_event in self.annotation_event_list:
+            if self.coalesce_edit_only_events and isinstance(annotation_event, EditOnlyEvent):
+                edit_only_events.append(annotation_event)
+            else:
+                allocation_tasks.append(('allocation.' + annotation_event.event_type,
+                                         annotation_event.get_new_stable_ids))
+        if edit_only_events:
+            allocation_tasks.append(('allocation.edit_only',
+                                     lambda: self._get_edit_only_stable_ids(edit_only_events)))
+
+        if self.max_concurrency > 1:
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                futures = [executor.submit(self._run_stage, stage_name, allocation_task)
+                           for stage_name, allocation_task in allocation_tasks]
+                for future in futures:
+                    future.result()
+        else:
+            for stage_name, allocation_task in allocation_tasks:
+                self._run_stage(stage_name, allocation_task)
+
+        with self.report.stage('update_ancestors'):
+            for annotation_event in self.annotation_event_list:
+                annotation_event.update_ancestors()
+
+    def _run_stage(self, stage_name, task):
+        with self.report.stage(stage_name):
+            task()
+
+    def _get_edit_only_stable_ids(self, edit_only_events):
+        """
+        Allocate the transcripts of all edit only events with one idSet. An event that
+        patches a gene already in the shared patch falls back to an idSet of its own.
+        The patches are collected first, the genes get their idSet once it is decided.
+        """
+        shared_events = list()
+        separate_events = list()
+        gene_owner = dict()
+        for annotation_event in edit_only_events:
+            gene_patches = annotation_event.get_transcript_patch()
+            if any(patch['geneId'] in gene_owner for _, patch in gene_patches):
+                separate_events.append(annotation_event)
+                continue
+            for _, patch in gene_patches:
+                gene_owner[patch['geneId']] = annotation_event
+            if gene_patches:
+                shared_events.append((annotation_event, gene_patches))
+
+        if shared_events:
+            organism_id = self.stable_id_service.get_organism_id(self.organism_name)
+            id_set_id, _ = self.stable_id_service.get_gene_id(organism_id, 0)
+            self._allocate_shared_id_set(id_set_id, shared_events, gene_owner)
+        for annotation_event in separate_events:
+            annotation_event.get_new_stable_ids()
+
+    def _allocate_shared_id_set(self, id_set_id, shared_events, gene_owner):
+        transcript_patch = list()
+        journal_genes = list()
+        for annotation_event, gene_patches in shared_events:
+            annotation_event.set_reference_ids(id_set_id, gene_patches)
+            for gene, patch in gene_patches:
+                transcript_patch.append(patch)
+                journal_genes.append((gene.source_id, patch['geneId']))
+        self.journal.record_id_set(id_set_id, journal_genes)
+
+        gene_model = self.stable_id_service.get_transcripts(id_set_id, transcript_patch)
+        self.journal.record_transcripts(id_set_id, gene_model)
+        event_gene_model = {annotation_event: list() for annotation_event, _ in shared_events}
+        for gene_info in gene_model:
+            event_gene_model[gene_owner[gene_info['geneId']]].append(gene_info)
+        for annotation_event, event_model in event_gene_model.items():
+            annotation_event._allocate_to_transcript(event_model)
+
+    def _restore_from_journal(self):
+        """
+        Give the genes of the journaled idSets their ids again. When the transcripts of an idSet were not
+        journaled the idSet is read back from OSID, and only patched when the PATCH did not reach OSID.
+        """
+        for id_set_id, id_set in self.journal.id_sets.items():
+            genes = list()
+            for source_id, gene_id in id_set['genes']:
+                gene = self.feature_index[source_id]
+                gene.osid_id = id_set_id
+                gene.allocated_id = gene_id
+                genes.append(gene)
+            generated_ids = id_set['generated_ids']
+            if generated_ids is None:
+                generated_ids = self.stable_id_service.get_id_set(id_set_id)
+                patched = {gene_info['geneId'] for gene_info in generated_ids if gene_info['transcripts']}
+                if any(gene.allocated_id not in patched for gene in genes if gene.mrnas):
+                    transcript_patch = [{'geneId': gene.allocated_id, 'transcripts': len(gene.mrnas)}
+                                        for gene in genes]
+                    generated_ids = self.stable_id_service.get_transcripts(id_set_id, transcript_patch)
+                self.journal.record_transcripts(id_set_id, generated_ids)
+            allocated_genes = {gene.allocated_id: gene for gene in genes}
+            for gene_info in generated_ids:
+                if gene_info['geneId'] in allocated_genes:
+                    allocated_genes[gene_info['geneId']].update_transcripts(gene_info['transcripts'],
+                                                                           gene_info['proteins'])
 
     def get_allocated_id(self, source_id):
         try:
@@ -47,18 +173,48 @@ class EventCollection:
         except KeyError:
             return None
 
+    def get_allocated_id_map(self):
+        """Return the allocated ids as a plain source id to allocated id map"""
+        allocated_ids = dict()
+        for source_id, feature in self.feature_index.items():
+            if feature.allocated_id:
+                allocated_ids[source_id] = feature.allocated_id
+        return AllocatedIdMap(allocated_ids)
+
+    def export_translation_map(self, path):
+        """Write the allocated ids to a memory-mappable translation map file, see translation_map.TranslationMap"""
+        translation_map.write_translation_map(path, self.get_allocated_id_map().allocated_ids)
+
+
+class AllocatedIdMap:
+    """Read-only source id to allocated id map, can stand in for an EventCollection when annotating a GFF"""
+
+    def __init__(self, allocated_ids):
+        self.allocated_ids = allocated_ids
+
+    def get_allocated_id(self, source_id):
+        return self.allocated_ids.get(source_id)
+
+    def get_allocated_id_map(self):
+        return self
+
 
 class AnnotationEvent:
-    def __init__(self, event_type, organism_name, event_connection, stable_id_service):
+    def __init__(self, event_type, organism_name, event_connection, stable_id_service,
+                 allocation_chunk_size=0, allocation_chunk_workers=1, journal=None):
         self.event_list = list()
         self.created_genes = list()
         self.gene_event_index = dict()
         self.allocated_index = dict()
+        self._allocation_cursor = 0
         self.new_gene_count = int()
         self.event_type = event_type
         self.organism_name = organism_name
         self.event_connection = event_connection
         self.stable_id_service = stable_id_service
+        self.allocation_chunk_size = allocation_chunk_size
+        self.allocation_chunk_workers = allocation_chunk_workers
+        self.journal = journal or AllocationJournal()
 
     def setup(self, index):
         events = self.event_connection.get_annotations_events(self.event_type)
@@ -82,8 +238,23 @@ class AnnotationEvent:
 
         return genes
 
+    def get_pending_genes(self):
+        """The created genes that did not get their ids from a resumed journal"""
+        return [gene for gene in self.created_genes if not self.journal.is_restored(gene.source_id)]
+
+    def _get_transcripts(self, id_set_id, transcript_patch):
+        requested_id = self.stable_id_service.get_transcripts(id_set_id, transcript_patch)
+        self.journal.record_transcripts(id_set_id, requested_id)
+        return requested_id
+
     def _allocate_to_gene(self, osid_id, gene_id):
-        for gene in self.created_genes:
+        """
+        Allocate gene_id to the next created gene without an allocated id. The cursor is reset at the
+        start of each allocation and does not go back within it, so an allocation is a single pass.
+        """
+        while self._allocation_cursor < len(self.created_genes):
+            gene = self.created_genes[self._allocation_cursor]
+            self._allocation_cursor += 1
             if not gene.allocated_id:
                 gene.osid_id = osid_id
                 gene.allocated_id = gene_id
@@ -101,12 +272,12 @@ class AnnotationEvent:
             ancestors = list()
             for gene in event:
                 if gene.source == 'reference':
-                    gene.known_events.add(self.event_type)
+                    gene.add_known_event(self.event_type)
                     ancestors.append(gene)
             for gene in event:
                 if gene.source != 'reference':
                     for ancestor_gene in ancestors:
-                        gene.ancestors.add(ancestor_gene)
+                        gene.add_ancestor(ancestor_gene)
 
 
 class CreateGeneModelEvent(AnnotationEvent):
@@ -115,34 +286,93 @@ class CreateGeneModelEvent(AnnotationEvent):
     """A merge of two or more gene models into one gene model"""
 
     def get_new_stable_ids(self):
+        pending_genes = self.get_pending_genes()
+        if not pending_genes:
+            return
         organism_id = self.stable_id_service.get_organism_id(self.organism_name)
-        id_set_id, generated_genes = self.stable_id_service.get_gene_id(organism_id, self.new_gene_count)
+        if 0 < self.allocation_chunk_size < len(pending_genes):
+            self._get_new_stable_ids_in_chunks(organism_id, pending_genes)
+            return
+        id_set_id, generated_genes = self.stable_id_service.get_gene_id(organism_id, len(pending_genes))
+        self._check_generated_genes(id_set_id, generated_genes, len(pending_genes))
+        self._allocation_cursor = 0
         transcript_patch = list()
         for gene in generated_genes:
             gene_id = gene['geneId']
             transcript_number = self._allocate_to_gene(id_set_id, gene_id)
             transcript_patch.append({'geneId': gene_id, 'transcripts': transcript_number})
-        requested_id = self.stable_id_service.get_transcripts(id_set_id, transcript_patch)
+        self.journal.record_id_set(id_set_id, [(self.allocated_index[patch['geneId']].source_id, patch['geneId'])
+                                               for patch in transcript_patch])
+        requested_id = self._get_transcripts(id_set_id, transcript_patch)
         self._allocate_to_transcript(requested_id)
 
+    @staticmethod
+    def _check_generated_genes(id_set_id, generated_genes, gene_count):
+        if len(generated_genes) != gene_count:
+            raise OSIDServiceError('idSet {} has {} gene ids, {} were requested'
+                                   .format(id_set_id, len(generated_genes), gene_count))
+
+    def _get_new_stable_ids_in_chunks(self, organism_id, genes):
+        """
+        Split the genes into batches of allocation_chunk_size, each batch gets its own idSet.
+        Up to allocation_chunk_workers batches are in flight at the same time.
+        """
+        chunks = list()
+        for start in range(0, len(genes), self.allocation_chunk_size):
+            chunks.append(genes[start:start + self.allocation_chunk_size])
+        with ThreadPoolExecutor(max_workers=self.allocation_chunk_workers) as executor:
+            futures = [executor.submit(self._allocate_chunk, organism_id, chunk) for chunk in chunks]
+            for future in futures:
+                self.allocated_index.update(future.result())
+
+    def _allocate_chunk(self, organism_id, genes):
+        id_set_id, generated_genes = self.stable_id_service.get_gene_id(organism_id, len(genes))
+        self._check_generated_genes(id_set_id, generated_genes, len(genes))
+        allocated_index = dict()
+        transcript_patch = list()
+        for gene, generated_gene in zip(genes, generated_genes):
+            gene.osid_id = id_set_id
+            gene.allocated_id = generated_gene['geneId']
+            allocated_index[gene.allocated_id] = gene
+            transcript_patch.append({'geneId': gene.allocated_id, 'transcripts': len(gene.mrnas)})
+        self.journal.record_id_set(id_set_id, [(gene.source_id, gene.allocated_id) for gene in genes])
+        requested_id = self._get_transcripts(id_set_id, transcript_patch)
+        for gene_info in requested_id:
+            allocated_index[gene_info['geneId']].update_transcripts(gene_info['transcripts'], gene_info['proteins'])
+        return allocated_index
+
 
 class EditOnlyEvent(AnnotationEvent):
     """A change to the gene model structure"""
     def get_new_stable_ids(self):
+        gene_patches = self.get_transcript_patch()
+        if not gene_patches:
+            return
         organism_id = self.stable_id_service.get_organism_id(self.organism_name)
         id_set_id, _ = self.stable_id_service.get_gene_id(organism_id, 0)
-        reference_gene = None
-        transcript_patch = list()
-        for created_gene in self.created_genes:
+        self.set_reference_ids(id_set_id, gene_patches)
+        self.journal.record_id_set(id_set_id, [(gene.source_id, patch['geneId']) for gene, patch in gene_patches])
+        gene_model = self._get_transcripts(id_set_id, [patch for _, patch in gene_patches])
+        self._allocate_to_transcript(gene_model)
+
+    def get_transcript_patch(self):
+        """
+        Return (created gene, transcript patch) pairs of the pending genes, each patched under the id of its
+        reference gene. The genes are not changed until set_reference_ids is called with the chosen idSet
+        """
+        gene_patches = list()
+        for created_gene in self.get_pending_genes():
             event = self.gene_event_index[created_gene.source_id]
+            reference_gene = None
             for gene in event:
                 if gene.source == 'reference':
                     reference_gene = gene
+            gene_patches.append((created_gene, {'geneId': reference_gene.source_id,
+                                                'transcripts': len(created_gene.mrnas)}))
+        return gene_patches
+
+    def set_reference_ids(self, id_set_id, gene_patches):
+        for created_gene, patch in gene_patches:
             created_gene.osid_id = id_set_id
-            created_gene.allocated_id = reference_gene.source_id
+            created_gene.allocated_id = patch['geneId']
             self.allocated_index[created_gene.allocated_id] = created_gene
-            transcript_number = len(created_gene.mrnas)
-
-            transcript_patch.append({'geneId': created_gene.allocated_id, 'transcripts': transcript_number})
-        gene_model = self.stable_id_service.get_transcripts(id_set_id, transcript_patch)
-        self._allocate_to_transcript(gene_model)
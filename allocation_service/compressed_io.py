@@ -0,0 +1,131 @@
+"""
+Copyright [2019-2020] EMBL-European Bioinformatics Institute
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import gzip
+import io
+import shutil
+import struct
+import subprocess
+import zlib
+"""Streaming plain, gzip and bgzip file I/O chosen from the file extension"""
+
+COMPRESSED_EXTENSIONS = ('.gz', '.bgz')
+BUFFER_SIZE = 1 << 20
+_BGZF_BLOCK_SIZE = 0xff00
+_BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+
+def is_compressed(path):
+    return path.endswith(COMPRESSED_EXTENSIONS)
+
+
+def open_file(path, mode='r', bgzip=False, threads=1, compress_level=6, newline=None):
+    """
+    Open a file for streaming reads or writes in text or binary mode. Files ending in .gz or .bgz are
+    decompressed or compressed on the fly, a .bgz file or bgzip=True writes BGZF so the output can be
+    indexed. With threads above one the pigz or bgzip command is used for compression when installed.
+    newline is passed on to the text layer, '\n' reads and writes the line endings untranslated.
+    """
+    binary = 'b' in mode
+    raw_mode = mode.replace('t', '').replace('b', '')
+    if not is_compressed(path):
+        if binary:
+            return open(path, raw_mode + 'b', buffering=BUFFER_SIZE)
+        return open(path, raw_mode, buffering=BUFFER_SIZE, newline=newline)
+
+    if raw_mode == 'r':
+        handle = gzip.open(path, 'rb')
+    elif bgzip or path.endswith('.bgz'):
+        if threads > 1 and shutil.which('bgzip'):
+            raw = PipeWriter(['bgzip', '-c', '-@', str(threads), '-l', str(compress_level)], path)
+        else:
+            raw = BgzfWriter(path, compress_level)
+        handle = io.BufferedWriter(raw, BUFFER_SIZE)
+    elif threads > 1 and shutil.which('pigz'):
+        handle = io.BufferedWriter(PipeWriter(['pigz', '-c', '-p', str(threads), '-' + str(compress_level)], path),
+                                   BUFFER_SIZE)
+    else:
+        handle = gzip.open(path, raw_mode + 'b', compresslevel=compress_level)
+
+    if binary:
+        return handle
+    return io.TextIOWrapper(handle, newline=newline)
+
+
+class BgzfWriter(io.RawIOBase):
+    """Writes BGZF, blocked gzip members with the BC extra field, ending with the BGZF EOF block"""
+
+    def __init__(self, path, compress_level=6):
+        self._handle = open(path, 'wb')
+        self._compress_level = compress_level
+        self._buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= _BGZF_BLOCK_SIZE:
+            self._write_block(bytes(self._buffer[:_BGZF_BLOCK_SIZE]))
+            del self._buffer[:_BGZF_BLOCK_SIZE]
+        return len(data)
+
+    def _write_block(self, data):
+        compressor = zlib.compressobj(self._compress_level, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        block_size = len(compressed) + 26
+        if block_size > 65536:
+            middle = len(data) // 2
+            self._write_block(data[:middle])
+            self._write_block(data[middle:])
+            return
+        self._handle.write(b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00')
+        self._handle.write(struct.pack('<H', block_size - 1))
+        self._handle.write(compressed)
+        self._handle.write(struct.pack('<II', zlib.crc32(data), len(data)))
+
+    def close(self):
+        if self.closed:
+            return
+        if self._buffer:
+            self._write_block(bytes(self._buffer))
+            self._buffer = bytearray()
+        self._handle.write(_BGZF_EOF)
+        self._handle.close()
+        super().close()
+
+
+class PipeWriter(io.RawIOBase):
+    """Streams the written bytes through an external compression command into path"""
+
+    def __init__(self, command, path):
+        self._handle = open(path, 'wb')
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=self._handle)
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._process.stdin.write(data)
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self._process.stdin.close()
+        return_code = self._process.wait()
+        self._handle.close()
+        super().close()
+        if return_code != 0:
+            raise OSError('{} exited with {}'.format(' '.join(self._process.args), return_code))
@@ -11,22 +11,84 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+import locale
+import pymysql.cursors
 from allocation_service import genomic_features
+from allocation_service import gff_attributes
+from allocation_service import compressed_io
 
 """Module for classes getting annotation event from different sources"""
 
 
+class UnsortedGFFError(ValueError):
+    """Raised when a GFF read with streaming='sorted' turns out unsorted after gene models were yielded"""
+
+
 class AnnotationEventDB:
+    transcript_chunk_size = 1000
 
-    def __init__(self, db_connection):
+    def __init__(self, db_connection, bulk_transcripts=True, transcript_connection=None):
         self.db_connection = db_connection
+        self.bulk_transcripts = bulk_transcripts
+        self.transcript_connection = transcript_connection or db_connection
+        self.transcript_index = dict()
+        self.event_types = list()
+        self._event_rows = None
+        self._next_event = None
+
+    def load_events(self, event_types):
+        """
+        Start one query over the gene_events rows of all event types, ordered by event type, on an
+        unbuffered cursor. get_annotations_events then takes the rows of each event type as the cursor
+        reaches them, so the event types must be asked for in sorted order. An unbuffered result blocks
+        its connection until it is drained, the transcripts are queried on transcript_connection meanwhile.
+        """
+        if self.transcript_connection is self.db_connection:
+            raise ValueError('Streaming the gene_events rows needs a separate transcript_connection')
+        self.event_types = sorted(event_types)
+        self._event_rows = self._stream_event_rows(self.event_types)
+        self._next_event = next(self._event_rows, None)
+
+    def _stream_event_rows(self, event_types):
+        placeholders = ", ".join(["%s"] * len(event_types))
+        event_sql = "select events, vb_gene_id, cap_gene_id from gene_events where events in ({0}) " \
+                    "order by field(events, {0});".format(placeholders)
+        with self.db_connection.cursor(pymysql.cursors.SSDictCursor) as cursor:
+            cursor.execute(event_sql, event_types + event_types)
+            for event in cursor:
+                yield event
 
     def get_annotations_events(self, event_type):
-        event_sql = "select vb_gene_id, cap_gene_id from gene_events where events = %s;"
-        event_db = self.execute_sql(event_sql, event_type)
-        return self.setup_gene_model(event_db, event_type)
+        return self.setup_gene_model(self.get_event_rows(event_type), event_type)
+
+    def get_event_rows(self, event_type):
+        """
+        Take the rows of one event type from the query started by load_events, reading up to the first row
+        of the next event type. Without load_events the event type is read with a query of its own.
+        """
+        if event_type not in self.event_types:
+            event_sql = "select vb_gene_id, cap_gene_id from gene_events where events = %s;"
+            with self.db_connection.cursor(pymysql.cursors.SSDictCursor) as cursor:
+                cursor.execute(event_sql, event_type)
+                return [{'vb_gene_id': event['vb_gene_id'], 'cap_gene_id': event['cap_gene_id']}
+                        for event in cursor]
+
+        position = self.event_types.index(event_type)
+        event_db = list()
+        while self._next_event is not None and self.event_types.index(self._next_event['events']) <= position:
+            if self._next_event['events'] == event_type:
+                event_db.append({'vb_gene_id': self._next_event['vb_gene_id'],
+                                 'cap_gene_id': self._next_event['cap_gene_id']})
+            self._next_event = next(self._event_rows, None)
+        return event_db
 
     def setup_gene_model(self, event_db, event_type):
+        if self.bulk_transcripts:
+            gene_ids = list()
+            for event in event_db:
+                gene_ids.extend(self.get_event_gene_ids(event, event_type))
+            self.load_transcripts(gene_ids)
+
         events = list()
         for event in event_db:
             genes = list()
@@ -56,17 +118,51 @@ class AnnotationEventDB:
                 events.append(genes)
         return events
 
+    @staticmethod
+    def get_event_gene_ids(event, event_type):
+        """Return the gene ids of one gene_events row in the order setup_gene_model uses them"""
+        if event_type == 'new_gene':
+            return [event['cap_gene_id']]
+        elif event_type == 'change_gene' or event_type == 'gain_iso_form' or event_type == 'lost_iso_form':
+            return [event['vb_gene_id'], event['cap_gene_id']]
+        elif event_type == 'split_gene':
+            return [event['vb_gene_id']] + event['cap_gene_id'].split(":")
+        elif event_type == 'merge_gene':
+            return [event['cap_gene_id']] + event['vb_gene_id'].split(":")
+        return list()
+
+    def load_transcripts(self, gene_ids):
+        """
+        Fetch the transcripts of many genes with chunked IN queries
+        and store them in the gene to transcripts index
+        """
+        missing_ids = list()
+        for gene_id in gene_ids:
+            if gene_id not in self.transcript_index:
+                self.transcript_index[gene_id] = list()
+                missing_ids.append(gene_id)
+
+        for start in range(0, len(missing_ids), self.transcript_chunk_size):
+            chunk = missing_ids[start:start + self.transcript_chunk_size]
+            sql = "select distinct gene_id, transcript_id from gene_model where gene_id in ({});"\
+                .format(", ".join(["%s"] * len(chunk)))
+            for transcript in self.execute_sql(sql, chunk):
+                self.transcript_index.setdefault(transcript['gene_id'], list()).append(transcript['transcript_id'])
+
     def add_transcripts(self, gene_id):
-        sql = "select distinct(transcript_id) from gene_model where gene_id = %s;"
-        transcript_db = self.execute_sql(sql, gene_id)
+        if gene_id in self.transcript_index:
+            transcript_ids = self.transcript_index[gene_id]
+        else:
+            sql = "select distinct(transcript_id) from gene_model where gene_id = %s;"
+            transcript_ids = [transcript['transcript_id'] for transcript in self.execute_sql(sql, gene_id)]
         transcript_list = list()
-        for transcript in transcript_db:
-            transcript_list.append({'id': transcript['transcript_id'], "children": [{'id': None}]})
+        for transcript_id in transcript_ids:
+            transcript_list.append({'id': transcript_id, "children": [{'id': None}]})
         return transcript_list
 
     def execute_sql(self, sql, values):
 
-        with self.db_connection.cursor() as cursor:
+        with self.transcript_connection.cursor() as cursor:
             cursor.execute(sql, values)
             return cursor.fetchall()
 
@@ -74,19 +170,35 @@ class AnnotationEventDB:
 class GffFilePasser:
     """Class for parsing GFF files"""
 
-    def __init__(self, gff_file_path, feature_filter, allowed_biotype):
+    def __init__(self, gff_file_path, feature_filter, allowed_biotype, streaming=None, span_feature_types=None):
+        """
+        streaming is None to build all gene models before the events are used,
+        'directives' to finish the gene models at every ### directive and
+        'sorted' to also finish them when a feature starts after all pending features
+        or on a new sequence region, for GFFs sorted by sequence region and start.
+        With span_feature_types the ID and Parent spans of those feature types are recorded
+        in feature_spans while parsing, so the GFF can be rewritten without parsing it again.
+        """
         self._current_gff_line = None
         self._current_fields = list()
         self._current_feature = None
         self._current_gff_id = None
         self._current_parent_id = None
+        self._models_flushed = False
+        self.gff_file_path = gff_file_path
+        self.streaming = streaming
         self.observers = list()
         self.genes = list()
         self.events = list()
-        self.allowed_feature = set()
+        self.allowed_feature = genomic_features.FeatureIdSet()
+        self._feature_observers = dict()
+        self.feature_spans = None
+        if span_feature_types is not None:
+            self.feature_spans = gff_attributes.FeatureSpanIndex(span_feature_types)
         self._load_feature_filter(feature_filter)
         self._instantiate_observers(allowed_biotype)
-        self._load_events_from_gff(gff_file_path)
+        if not self.streaming:
+            self._load_events_from_gff(gff_file_path)
 
     def _instantiate_observers(self, file_path):
         with open(file_path, 'r') as file:
@@ -98,9 +210,14 @@ class GffFilePasser:
                     self.observers.append(genomic_features.NcRnaGene(allowed_feature=self.allowed_feature))
                 elif allowed_object == 'pseudogene':
                     self.observers.append(genomic_features.PseudoGene(allowed_feature=self.allowed_feature))
+        for observer in self.observers:
+            for feature_type, model_layer in observer.allowed_feature_type.items():
+                self._feature_observers.setdefault(feature_type, list()).append((observer, model_layer))
 
     def get_annotations_events(self, event_type):
         if event_type == 'new_gene':
+            if self.streaming:
+                return self._generate_events(self.gff_file_path, self.streaming)
             return self.events
         else:
             return list()  # return empty list
@@ -112,21 +229,89 @@ class GffFilePasser:
                 self.allowed_feature.add(feature_id)
 
     def _load_events_from_gff(self, gff_file_path):
-        with open(gff_file_path, 'r') as file:
+        self.events = list(self._generate_events(gff_file_path))
+
+    def _generate_events(self, gff_file_path, streaming=None):
+        """
+        Yield the finished gene models of each observer as an event. Without streaming
+        the models are only finished at the end of the file.
+        """
+        sorted_input = streaming == 'sorted'
+        self._models_flushed = False
+        seq_regions = set()
+        seq_region = None
+        previous_start = 0
+        pending_end = 0
+        for line in self._read_lines(gff_file_path):
+            self._current_gff_line = line.rstrip()
+            if streaming and self._current_gff_line == '###':
+                yield from self._finish_models()
+                continue
+            self._current_fields = self._current_gff_line.split("\t")
+
+            if self._is_feature_line():
+                self._current_feature = self._current_fields[2]
+                feature_observers = self._feature_observers.get(self._current_feature)
+                if feature_observers is None:
+                    continue
+                if sorted_input:
+                    start = int(self._current_fields[3])
+                    if self._current_fields[0] != seq_region:
+                        if self._current_fields[0] in seq_regions:
+                            sorted_input = self._unsorted_input()
+                        else:
+                            yield from self._finish_models()
+                            seq_region = self._current_fields[0]
+                            seq_regions.add(seq_region)
+                            pending_end = 0
+                    elif start < previous_start:
+                        sorted_input = self._unsorted_input()
+                    elif start > pending_end:
+                        yield from self._finish_models()
+                    previous_start = start
+                    pending_end = max(pending_end, int(self._current_fields[4]))
+                self._current_gff_id, self._current_parent_id = self._extract_ids()
+                for observer, model_layer in feature_observers:
+                    observer.add_feature(model_layer, self._current_gff_id, self._current_parent_id)
+        yield from self._finish_models()
+
+    def _read_lines(self, gff_file_path):
+        """
+        Yield the lines of the GFF, the spans are recorded from the raw bytes before a line is decoded
+        with the encoding of the text reads. The spans of an earlier parse are dropped
+        """
+        if self.feature_spans is None:
+            with compressed_io.open_file(gff_file_path, 'r') as file:
+                yield from file
+            return
+        self.feature_spans.clear()
+        encoding = locale.getpreferredencoding(False)
+        offset = 0
+        with compressed_io.open_file(gff_file_path, 'rb') as file:
             for line in file:
-                self._current_gff_line = line.rstrip()
-                self._current_fields = self._current_gff_line.split("\t")
-
-                if self._is_feature_line():
-                    self._current_feature = self._current_fields[2]
-                    self._current_gff_id, self._current_parent_id = self._extract_ids()
-                    for observer in self.observers:
-                        observer.add_allowed_feature(self._current_feature,
-                                                     self._current_gff_id, self._current_parent_id)
+                self.feature_spans.add_line(offset, line)
+                offset += len(line)
+                yield line.decode(encoding)
+
+    def _finish_models(self):
         for observer in self.observers:
             finished_models = observer.build_model()
+            observer.clear_features()
             if len(finished_models) > 0:
-                self.events.append(finished_models)
+                self._models_flushed = True
+                yield finished_models
+
+    def _unsorted_input(self):
+        """
+        Buffer the remaining gene models when no model was yielded yet. Once models were yielded a late
+        child could belong to one of them, and they cannot be rebuilt, so the parse stops instead
+        """
+        if self._models_flushed:
+            raise UnsortedGFFError('GFF {} is not sorted at line: {}, sort it by sequence region and start '
+                                   'or read it with streaming=None'.format(self.gff_file_path, self._current_gff_line))
+        print('GFF {} is not sorted at line: {}, buffering the remaining gene models'
+              .format(self.gff_file_path, self._current_gff_line))
+        return False
 
     def _is_feature_line(self):
         if len(self._current_fields) == 9:
@@ -136,34 +321,15 @@ class GffFilePasser:
 
     def _extract_ids(self):
         """
-        Extract the ID and Parent of the current gff feature
+        Extract the ID and Parent of the current gff feature, the first Parent of a multi-parent feature is used
         """
-
-        gff_id = None
-        parent = None
         try:
-            attribs = self._extract_attribs()
-            if "ID" in attribs:
-                gff_id = attribs["ID"]
-            if "Parent" in attribs:
-                parent = attribs["Parent"]
-        except:
-            pass
-
-        return gff_id, parent
-
-    def _extract_attribs(self):
-        """
-        Extract the attribs from the gff feature line
-        Returns a dict of attribs with their key
-        """
-        attrib_col = self._current_fields[8]
-        
-        attribs = {}
-        for field in attrib_col.split(";"):
-            if field:
-                (key, value) = field.split("=")
-                attribs[key] = value
-        
-        return attribs
-    
+            gff_id, parents = gff_attributes.extract_ids(self._current_fields[8])
+        except gff_attributes.GFFAttributeError as attribute_error:
+            print('Bad GFF line ({}): {}'.format(attribute_error, self._current_gff_line))
+            return None, None
+
+        if parents:
+            return gff_id, parents[0]
+        return gff_id, None
+
@@ -12,39 +12,262 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import io
+import mmap
+import os
 import re
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import unquote_to_bytes
 from session_service import rest_api
+from allocation_service import gff_attributes
+from allocation_service import compressed_io
+from allocation_service.allocation_journal import AllocationJournal
+from allocation_service.run_report import RunReport
+from allocation_service.translation_map import TranslationMap
 """module of classes that format the event into different outputs """
 
+_RESERVED_BYTES = re.compile(rb'[%;=,&\t]')
+# group 1 is an ID or Parent value, it is None for values with percent encoding, several parents,
+# spaces or a carriage return, those lines are always split
+_ID_PARENT_VALUE = re.compile(rb'[\t;](?:ID|Parent)=(?:([^;\t\n%, \r]*)(?![^;\t\n])|[^;\t\n]*)')
+
 
 class GFFAnnotations:
     allowed_feature = {'gene', 'mRNA', 'CDS', 'exon', 'pseudogene', 'pseudogenic_transcript', 'ncRNA_gene', 'tRNA'}
+    write_buffer_size = 1 << 20
 
-    def __init__(self, input_gff_file, output_gff_file, event_collection):
+    def __init__(self, input_gff_file, output_gff_file, event_collection, bgzip=False, compression_threads=1,
+                 mapped_translation_map=False):
+        """
+        A TranslationMap event_collection is read into a dict for the rewrite, with mapped_translation_map
+        the ids are looked up in the memory-mapped file instead, slower but without holding the map in memory
+        """
         self.in_gff_file = input_gff_file
         self.out_gff_file = output_gff_file
         self.event_collection = event_collection
+        self.bgzip = bgzip
+        self.compression_threads = compression_threads
+        self.mapped_translation_map = mapped_translation_map
         self._current_gff_line = None
         self._current_fields = list()
         self._output_gff_handle = None
 
-    def annotate_gff(self):
-        """open gff file """
-        input_gff_handle = open(self.in_gff_file, 'r')
-        self._output_gff_handle = open(self.out_gff_file, 'w')
+    def annotate_gff(self, processes=1):
+        """
+        open gff file, gzip and bgzip files are read and written compressed. With more than one process
+        the GFF is split into shards at sequence region and ### boundaries, the shards are rewritten
+        in a process pool and joined in order. A compressed input GFF is always rewritten serially,
+        a single uncompressed GFF is rewritten through a memory map. All of them write the same bytes,
+        the line endings and trailing whitespace of the input are kept.
+        """
+        if not compressed_io.is_compressed(self.in_gff_file):
+            if processes > 1:
+                shards = self._get_shards(processes)
+                if len(shards) > 1:
+                    self._annotate_gff_shards(shards, processes)
+                    return
+            self._annotate_mapped_gff()
+            return
+        with compressed_io.open_file(self.in_gff_file, 'r', newline='\n') as input_gff_handle, \
+                compressed_io.open_file(self.out_gff_file, 'w', self.bgzip, self.compression_threads,
+                                        newline='\n') as output_gff_handle:
+            self.annotate_text(input_gff_handle, output_gff_handle)
+
+    def annotate_text(self, input_gff_handle, output_gff_handle):
+        """Rewrite the GFF lines of a text handle opened with newline='\n' to output_gff_handle"""
+        self._output_gff_handle = output_gff_handle
+        try:
+            self._annotate_lines(input_gff_handle)
+        finally:
+            self._output_gff_handle = None
+
+    def annotate_gff_from_spans(self, feature_spans):
+        """
+        Rewrite the GFF from the ID and Parent spans recorded by GffFilePasser, only the spans are patched
+        and the rest of the file is copied as raw bytes without parsing it again
+        """
+        with compressed_io.open_file(self.in_gff_file, 'rb') as input_gff_handle, \
+                compressed_io.open_file(self.out_gff_file, 'wb', self.bgzip,
+                                        self.compression_threads) as output_gff_handle:
+            allocated_ids = self._get_encoded_id_map()
+            position = 0
+            last_byte = b''
+            for (start, end), value in self._get_replacements(feature_spans, allocated_ids):
+                self._copy_bytes(input_gff_handle, output_gff_handle, start - position)
+                output_gff_handle.write(value)
+                input_gff_handle.read(end - start)
+                position = end
+                last_byte = value[-1:]
+            last_byte = self._copy_bytes(input_gff_handle, output_gff_handle, None) or last_byte
+            if last_byte not in (b'', b'\n'):
+                output_gff_handle.write(b'\n')
+
+    def _annotate_mapped_gff(self):
+        """
+        Rewrite an uncompressed GFF through a memory map. The ID and Parent values are found by a regular
+        expression over the mapped bytes and only the lines with a value in the allocation map are split
+        and patched, unchanged byte ranges are written from memoryview slices without decoding them.
+        Line endings are kept as in the input.
+        """
+        allocated_ids = self._get_encoded_id_map()
+        if isinstance(allocated_ids, EncodedTranslationMap):
+            candidate_ids = allocated_ids
+        else:
+            candidate_ids = set(allocated_ids)
+            candidate_ids.update(source_id[:-4] for source_id in allocated_ids if source_id.endswith(b'-CDS'))
+        feature_spans = gff_attributes.FeatureSpanIndex(self.allowed_feature)
+        with open(self.in_gff_file, 'rb') as input_gff_handle, \
+                compressed_io.open_file(self.out_gff_file, 'wb', self.bgzip,
+                                        self.compression_threads) as output_gff_handle:
+            if os.fstat(input_gff_handle.fileno()).st_size == 0:
+                return
+            with mmap.mmap(input_gff_handle.fileno(), 0, access=mmap.ACCESS_READ) as gff_map, \
+                    memoryview(gff_map) as gff_data:
+                line_end = 0
+                for match in _ID_PARENT_VALUE.finditer(gff_map):
+                    value = match[1]
+                    if value is not None and value not in candidate_ids:
+                        continue
+                    match_start = match.start()
+                    if match_start < line_end:
+                        continue
+                    line_start = gff_map.rfind(b'\n', 0, match_start) + 1
+                    line_end = gff_map.find(b'\n', match.end())
+                    if line_end == -1:
+                        line_end = len(gff_map)
+                    feature_spans.add_line(line_start, gff_map[line_start:line_end])
+
+                position = 0
+                last_byte = b''
+                for (start, end), value in self._get_replacements(feature_spans, allocated_ids):
+                    output_gff_handle.write(gff_data[position:start])
+                    output_gff_handle.write(value)
+                    position = end
+                    last_byte = value[-1:]
+                if position < len(gff_data):
+                    output_gff_handle.write(gff_data[position:])
+                    last_byte = gff_map[-1:]
+                if last_byte != b'\n':
+                    output_gff_handle.write(b'\n')
+
+    def _get_replacements(self, feature_spans, allocated_ids):
+        """Yield ((start, end), encoded value) for the ID and Parent spans that have an allocated id, in file order"""
+        for is_cds, id_span, id_value, parent_span, parent_value in feature_spans:
+            replacements = list()
+            if id_span is not None:
+                source_id = id_value
+                if is_cds and parent_value is not None:
+                    source_id = parent_value.split(b',', 1)[0] + b'-CDS'
+                allocated_id = self._get_encoded_allocated_id(allocated_ids, source_id)
+                if allocated_id:
+                    replacements.append((id_span, allocated_id))
+            if parent_span is not None:
+                new_parent_value = b','.join(self._get_encoded_allocated_id(allocated_ids, parent) or parent
+                                             for parent in parent_value.split(b','))
+                if new_parent_value != parent_value:
+                    replacements.append((parent_span, new_parent_value))
+            replacements.sort()
+            yield from replacements
 
+    def _get_encoded_id_map(self):
+        """Return the allocated ids keyed by the UTF-8 source id, with the allocated ids encoded for column 9"""
+        allocated_id_map = self.event_collection.get_allocated_id_map()
+        if isinstance(allocated_id_map, TranslationMap):
+            if self.mapped_translation_map:
+                return EncodedTranslationMap(allocated_id_map)
+            allocated_ids = allocated_id_map.items()
+        else:
+            allocated_ids = allocated_id_map.allocated_ids.items()
+        return {source_id.encode(): gff_attributes.encode_value(allocated_id).encode()
+                for source_id, allocated_id in allocated_ids}
+
+    @staticmethod
+    def _get_encoded_allocated_id(allocated_ids, value):
+        if b'%' in value:
+            value = unquote_to_bytes(value)
+        return allocated_ids.get(value)
+
+    def _copy_bytes(self, input_handle, output_handle, size):
+        """Copy size bytes, or up to the end of the file when size is None, and return the last byte copied"""
+        last_byte = b''
+        while size is None or size > 0:
+            read_size = self.write_buffer_size if size is None else min(size, self.write_buffer_size)
+            data = input_handle.read(read_size)
+            if not data:
+                break
+            output_handle.write(data)
+            last_byte = data[-1:]
+            if size is not None:
+                size -= len(data)
+        return last_byte
+
+    def _annotate_lines(self, input_gff_handle):
+        """
+        Rewrite the lines of a GFF opened with newline='\n', a rewritten line keeps its trailing
+        whitespace and line ending, only a last line without one gets a newline
+        """
         for line in input_gff_handle:
             self._current_gff_line = line.rstrip()
-            self._current_fields = self._current_gff_line.rstrip().split("\t")
+            self._current_fields = self._current_gff_line.split("\t")
+            line_end = line[len(self._current_gff_line):]
+            if not line_end.endswith('\n'):
+                line_end += '\n'
             if self._is_feature_line():
                 source_id, source_parent_id = self._extract_ids()
                 allocated_id, allocated_parent = self._get_feature_info(source_id, source_parent_id)
-                self._update_gff_feature(allocated_id, allocated_parent)
-            else:
-                """write to GFF"""
-                self._output_gff_handle.write(self._current_gff_line + '\n')
-        input_gff_handle.close()
-        self._output_gff_handle.close()
+                if allocated_id or allocated_parent or self._has_several_parents():
+                    self._update_gff_feature(allocated_id, allocated_parent, line_end)
+                    continue
+            """copy to GFF unchanged"""
+            self._output_gff_handle.write(self._current_gff_line + line_end)
+
+    def _get_shards(self, processes):
+        """Return the (start, end) byte ranges of the shards, shards only end where a sequence region ends"""
+        file_size = os.path.getsize(self.in_gff_file)
+        shard_size = max(file_size // (processes * 4), 1)
+        shards = list()
+        shard_start = 0
+        offset = 0
+        seq_region = None
+        with open(self.in_gff_file, 'rb') as file:
+            for line in file:
+                if line.startswith(b'#'):
+                    offset += len(line)
+                    if line.rstrip() == b'###' and offset - shard_start >= shard_size:
+                        shards.append((shard_start, offset))
+                        shard_start = offset
+                    continue
+                line_seq_region = line.split(b'\t', 1)[0]
+                if line_seq_region != seq_region:
+                    if seq_region is not None and offset - shard_start >= shard_size:
+                        shards.append((shard_start, offset))
+                        shard_start = offset
+                    seq_region = line_seq_region
+                offset += len(line)
+        if offset > shard_start:
+            shards.append((shard_start, offset))
+        return shards
+
+    def _annotate_gff_shards(self, shards, processes):
+        shard_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(self.out_gff_file)))
+        try:
+            shard_files = [os.path.join(shard_dir, 'shard_{}.gff'.format(number)) for number in range(len(shards))]
+            allocated_id_map = self.event_collection.get_allocated_id_map()
+            with ProcessPoolExecutor(max_workers=processes, initializer=_init_shard_worker,
+                                     initargs=(allocated_id_map,)) as executor:
+                futures = [executor.submit(_annotate_shard, self.in_gff_file, start, end, shard_file)
+                           for (start, end), shard_file in zip(shards, shard_files)]
+                for future in futures:
+                    future.result()
+            with compressed_io.open_file(self.out_gff_file, 'wb', self.bgzip,
+                                         self.compression_threads) as out_gff_handle:
+                for shard_file in shard_files:
+                    with open(shard_file, 'rb') as shard_handle:
+                        shutil.copyfileobj(shard_handle, out_gff_handle, self.write_buffer_size)
+        finally:
+            shutil.rmtree(shard_dir)
 
     def _is_feature_line(self):
         if len(self._current_fields) == 9 and self._current_fields[2] in self.allowed_feature:
@@ -52,63 +275,121 @@ class GFFAnnotations:
         else:
             return False
 
+    def _has_several_parents(self):
+        """A later Parent of a multi-parent feature may be allocated when the first is not"""
+        attributes = self._current_fields[8]
+        if ',' not in attributes:
+            return False
+        parent_span = gff_attributes.value_span(attributes, 'Parent')
+        return parent_span is not None and ',' in attributes[parent_span[0]:parent_span[1]]
+
     def _get_feature_info(self, source_id, source_parent_id):
         allocated_id = self.event_collection.get_allocated_id(source_id)
         allocated_parent = self.event_collection.get_allocated_id(source_parent_id)
 
         return allocated_id, allocated_parent
 
-    def _update_gff_feature(self, allocated_id, allocated_parent):
+    def _update_gff_feature(self, allocated_id, allocated_parent, line_end='\n'):
+        """Splice the allocated ID and Parent values into the attribute column by offset"""
+        attributes = self._current_fields[8]
+        replacements = list()
 
-        if allocated_id is not None:
-            new_id = 'ID={};'.format(allocated_id)
-            self._current_gff_line = re.sub(r'ID=.*?;', new_id, self._current_gff_line)
+        if allocated_id:
+            id_span = gff_attributes.value_span(attributes, 'ID')
+            if id_span is not None:
+                replacements.append((id_span, gff_attributes.encode_value(allocated_id)))
 
-        if allocated_parent is not None:
-            new_parent_id = 'Parent={};'.format(allocated_parent)
-            self._current_gff_line = re.sub(r'Parent=.*?;', new_parent_id, self._current_gff_line)
+        parent_span = gff_attributes.value_span(attributes, 'Parent')
+        if parent_span is not None:
+            parent_value = attributes[parent_span[0]:parent_span[1]]
+            if ',' in parent_value:
+                new_parent_value = self._get_allocated_parents(parent_value)
+                if new_parent_value != parent_value:
+                    replacements.append((parent_span, new_parent_value))
+            elif allocated_parent:
+                replacements.append((parent_span, gff_attributes.encode_value(allocated_parent)))
 
-        self._output_gff_handle.write(self._current_gff_line + '\n')
+        column_start = len(self._current_gff_line) - len(attributes)
+        self._output_gff_handle.write(self._current_gff_line[:column_start])
+        position = 0
+        for (start, end), value in sorted(replacements):
+            self._output_gff_handle.write(attributes[position:start])
+            self._output_gff_handle.write(value)
+            position = end
+        self._output_gff_handle.write(attributes[position:])
+        self._output_gff_handle.write(line_end)
+
+    def _get_allocated_parents(self, parent_value):
+        parents = list()
+        for parent in parent_value.split(','):
+            allocated_parent = self.event_collection.get_allocated_id(gff_attributes.decode_value(parent))
+            if allocated_parent:
+                parents.append(gff_attributes.encode_value(allocated_parent))
+            else:
+                parents.append(parent)
+        return ','.join(parents)
 
     def _extract_ids(self):
         """
-        Extract the ID and Parent of the current gff feature
+        Extract the ID and Parent of the current gff feature, the first Parent of a multi-parent feature is used
         """
 
-        gff_id = None
-        parent = None
         try:
-            attribs = self._extract_attribs()
-            if "ID" in attribs:
-                gff_id = attribs["ID"]
-            if "Parent" in attribs:
-                parent = attribs["Parent"]
-            if self._current_fields[2] == 'CDS':
-                gff_id = parent + '-CDS'
-        except:
-            pass
+            gff_id, parents = gff_attributes.extract_ids(self._current_fields[8])
+        except gff_attributes.GFFAttributeError as attribute_error:
+            print('Bad GFF line ({}): {}'.format(attribute_error, self._current_gff_line))
+            return None, None
+
+        parent = None
+        if parents:
+            parent = parents[0]
+        if self._current_fields[2] == 'CDS' and parent is not None:
+            gff_id = parent + '-CDS'
 
         return gff_id, parent
 
-    def _extract_attribs(self):
-        """
-        Extract the attribs from the gff feature line
-        Returns a dict of attribs with their key
-        """
-        attrib_col = self._current_fields[8]
 
-        attribs = {}
-        for field in attrib_col.split(";"):
-            if field:
-                (key, value) = field.split("=")
-                attribs[key] = value
+class EncodedTranslationMap:
+    """
+    Byte level view of a TranslationMap for the memory-mapped GFF rewrite, get returns the allocated id
+    encoded for column 9. A value is a candidate for rewriting when it or its CDS id is in the map.
+    Allocated ids without reserved characters are returned as they are in the map.
+    """
+
+    def __init__(self, translation_map):
+        self.translation_map = translation_map
+
+    def get(self, source_id):
+        allocated_id = self.translation_map.get(source_id)
+        if allocated_id is None or not _RESERVED_BYTES.search(allocated_id):
+            return allocated_id
+        return gff_attributes.encode_value(allocated_id.decode()).encode()
+
+    def __contains__(self, value):
+        return value in self.translation_map or value + b'-CDS' in self.translation_map
+
 
-        return attribs
+_shard_allocated_id_map = None
+
+
+def _init_shard_worker(allocated_id_map):
+    global _shard_allocated_id_map
+    _shard_allocated_id_map = allocated_id_map
+
+
+def _annotate_shard(in_gff_file, start, end, shard_file):
+    """Rewrite one byte range of the GFF in a worker process"""
+    with open(in_gff_file, 'rb') as file:
+        file.seek(start)
+        shard = file.read(end - start)
+    gff_annotation = GFFAnnotations(in_gff_file, shard_file, _shard_allocated_id_map)
+    with open(shard_file, 'w', buffering=gff_annotation.write_buffer_size, newline='\n') as shard_handle:
+        gff_annotation.annotate_text(io.TextIOWrapper(io.BytesIO(shard), newline='\n'), shard_handle)
 
 
 class AnnotationEventFile:
-    def __init__(self, event_collection, out_file):
-        self.file_handle = open(out_file, 'w')
+    def __init__(self, event_collection, out_file, bgzip=False, compression_threads=1):
+        self.file_handle = compressed_io.open_file(out_file, 'w', bgzip, compression_threads)
         self.event_collection = event_collection
 
     def write_event_file(self):
@@ -118,12 +399,12 @@ class AnnotationEventFile:
                 flag = event_type + '_written_to_history_file'
                 for gene in event:
                     if gene.source != 'reference' and flag not in gene.status_flags:
-                        gene.status_flags.add(flag)
+                        gene.add_status_flag(flag)
                         if len(gene.ancestors) == 0 and gene.allocated_id:
                             self.file_handle.write(gene.allocated_id
                                                    + "\t" + event_type + "\t" + '' + "\n")
                         else:
-                            for ancestor in gene.ancestors:
+                            for ancestor in sorted(gene.ancestors, key=lambda ancestor: ancestor.source_id):
                                 if event_type in ancestor.known_events:
                                     self.file_handle.write(gene.allocated_id
                                                            + "\t" + event_type + "\t" + ancestor.source_id + "\n")
@@ -132,38 +413,121 @@ class AnnotationEventFile:
 
 
 class SessionService:
+    bulk_chunk_size = 5000
 
-    def __init__(self, session_database, application_id, production_database_id, commit_message, event_collection):
+    def __init__(self, session_database, application_id, production_database_id, commit_message, event_collection,
+                 bulk=True, journal=None, report=None):
         self.database = session_database
         self.application_id = application_id
         self.production_database_id = production_database_id
         self.commit_message = commit_message
         self.event_collection = event_collection
+        self.journal = journal or AllocationJournal()
+        self.report = report or RunReport()
         self.session_table = rest_api.Session(self.database)
+        self.session_index = dict()
+        features = list()
         for annotation_event_type in self.event_collection.annotation_event_list:
 
             for event in annotation_event_type.event_list:
                 for gene in event:
                     if gene.allocated_id and "written_to_session_database" not in gene.status_flags:
-                        self.add_feature(gene, 'gene')
-                        gene.status_flags.add("written_to_session_database")
+                        features.append((gene, 'gene'))
+                        gene.add_status_flag("written_to_session_database")
                         for mrna in gene.mrnas:
-                            self.add_feature(mrna, 'transcript')
+                            features.append((mrna, 'transcript'))
+        features = [(feature, feature_type) for feature, feature_type in features
+                    if feature.allocated_id not in self.journal.written_stable_ids]
+        if bulk:
+            self.add_features(features)
+        else:
+            for feature, feature_type in features:
+                self.add_feature(feature, feature_type)
 
     def add_feature(self, feature, feature_type):
-        session_id = self.session_table.get(osid_idsetid=feature.osid_id)
-
-        if not session_id:
-            session_id = self.session_table.post(
-                application_id=self.application_id, production_database_id=self.production_database_id,
-                osid_idsetid=feature.osid_id, message=self.commit_message)
+        session_id = self._get_session_id(feature.osid_id)
 
-        stable_identifier_record = rest_api.StableIdentifierRecord(self.database)
-        stable_identifier_record_id = stable_identifier_record.post(
-                stable_identifier=feature.allocated_id, status='current', feature_type=feature_type)
+        stable_identifier_record_id = self.journal.written_records.get(feature.allocated_id)
+        if not stable_identifier_record_id:
+            stable_identifier_record = rest_api.StableIdentifierRecord(self.database)
+            stable_identifier_record_id = stable_identifier_record.post(
+                    stable_identifier=feature.allocated_id, status='current', feature_type=feature_type)
+            if stable_identifier_record_id:
+                self.report.count('session_records')
+                self.journal.record_session_records({feature.allocated_id: stable_identifier_record_id})
         if stable_identifier_record_id:
             session_identifier_action = rest_api.SessionIdentifierAction(self.database)
-            _ = session_identifier_action.post(
-                    stable_identifier_record_id=stable_identifier_record_id, session_id=session_id, action='create')
+            if session_identifier_action.post(
+                    stable_identifier_record_id=stable_identifier_record_id, session_id=session_id, action='create'):
+                self.report.count('session_actions')
+                self.journal.record_session_rows([feature.allocated_id])
         else:
             print('NOT loaded: ', feature.allocated_id)
+
+    def add_features(self, features):
+        """
+        Write the records and actions of many features with bulk inserts, one transaction per chunk.
+        A chunk whose records or actions transaction fails is reported, returns False when any chunk failed.
+        The inserted records are journaled before their actions are written, so a resumed run reuses the
+        records of its failed run and writes their missing actions. Any other existing record is NOT loaded
+        """
+        stable_identifier_record = rest_api.StableIdentifierRecord(self.database)
+        session_identifier_action = rest_api.SessionIdentifierAction(self.database)
+        all_written = True
+        for start in range(0, len(features), self.bulk_chunk_size):
+            chunk = features[start:start + self.bulk_chunk_size]
+            records = [{'stable_identifier': feature.allocated_id, 'status': 'current', 'feature_type': feature_type}
+                       for feature, feature_type in chunk if feature.allocated_id not in self.journal.written_records]
+            record_ids = stable_identifier_record.post_many(records)
+            if record_ids is False:
+                print('Failed to write the stable identifier records of features {} to {}, chunk NOT loaded'
+                      .format(start + 1, start + len(chunk)))
+                all_written = False
+                continue
+            if record_ids:
+                self.journal.record_session_records(record_ids)
+            self.report.count('session_records', len(record_ids))
+            for feature, _ in chunk:
+                if feature.allocated_id in self.journal.written_records:
+                    record_ids[feature.allocated_id] = self.journal.written_records[feature.allocated_id]
+            actions = list()
+            written_stable_ids = list()
+            for feature, _ in chunk:
+                session_id = self._get_session_id(feature.osid_id)
+                if feature.allocated_id in record_ids and session_id:
+                    actions.append({'stable_identifier_record_id': record_ids[feature.allocated_id],
+                                    'session_id': session_id, 'action': 'create'})
+                    written_stable_ids.append(feature.allocated_id)
+                else:
+                    print('NOT loaded: ', feature.allocated_id)
+            if session_identifier_action.post_many(actions):
+                self.report.count('session_actions', len(actions))
+                self.journal.record_session_rows(written_stable_ids)
+            else:
+                print('Failed to write the session identifier actions of features {} to {}, chunk NOT loaded'
+                      .format(start + 1, start + len(chunk)))
+                all_written = False
+        return all_written
+
+    def _get_session_id(self, osid_id):
+        """
+        Resolve or create the session row of an OSID idSet once per run.
+        Failed posts are not cached, the next feature of the idSet looks the row up again
+        """
+        if osid_id in self.session_index:
+            return self.session_index[osid_id]
+        if osid_id in self.journal.sessions:
+            self.session_index[osid_id] = self.journal.sessions[osid_id]
+            return self.session_index[osid_id]
+
+        session_id = self.session_table.get(osid_idsetid=osid_id)
+        if not session_id:
+            session_id = self.session_table.post(
+                application_id=self.application_id, production_database_id=self.production_database_id,
+                osid_idsetid=osid_id, message=self.commit_message)
+            if not session_id:
+                session_id = self.session_table.get(osid_idsetid=osid_id)
+        if session_id:
+            self.session_index[osid_id] = session_id
+            self.journal.record_session(osid_id, session_id)
+        return session_id
@@ -12,17 +12,91 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import sys
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
 """module for all genomic feature classes"""
 
 
+class FeatureIdSet:
+    """
+    Compact set of feature ids for large allowed_gene_models lists. The ids are kept as UTF-8 bytes in one
+    buffer sorted by their 64 bit hash, membership is a binary search on the hashes and each hash hit is
+    confirmed against the id itself.
+    """
+
+    def __init__(self, feature_ids=()):
+        self._hashes = array('q')
+        self._ends = array('Q')
+        self._ids = bytearray()
+        self._sorted = True
+        for feature_id in feature_ids:
+            self.add(feature_id)
+
+    def add(self, feature_id):
+        self._hashes.append(hash(feature_id))
+        self._ids += feature_id.encode()
+        self._ends.append(len(self._ids))
+        self._sorted = False
+
+    def _id(self, position):
+        start = self._ends[position - 1] if position else 0
+        return bytes(self._ids[start:self._ends[position]])
+
+    def _sort(self):
+        hashes, ends, ids = array('q'), array('Q'), bytearray()
+        same_hash_ids = list()
+        for position in sorted(range(len(self._hashes)), key=self._hashes.__getitem__):
+            feature_hash, feature_id = self._hashes[position], self._id(position)
+            if not hashes or hashes[-1] != feature_hash:
+                same_hash_ids = list()
+            elif feature_id in same_hash_ids:
+                continue
+            same_hash_ids.append(feature_id)
+            hashes.append(feature_hash)
+            ids += feature_id
+            ends.append(len(ids))
+        self._hashes, self._ends, self._ids = hashes, ends, ids
+        self._sorted = True
+
+    def __contains__(self, feature_id):
+        if not isinstance(feature_id, str):
+            return False
+        if not self._sorted:
+            self._sort()
+        feature_hash = hash(feature_id)
+        position = bisect_left(self._hashes, feature_hash)
+        while position < len(self._hashes) and self._hashes[position] == feature_hash:
+            if self._id(position) == feature_id.encode():
+                return True
+            position += 1
+        return False
+
+    def __len__(self):
+        if not self._sorted:
+            self._sort()
+        return len(self._hashes)
+
+
 class GenomicFeatureModel:
-    """Base class for building feature models i.e gene models in JSON."""
+    """
+    Base class for building feature models i.e gene models in JSON.
+    With allowed_feature only the subtrees of allowed top level features are stored.
+    """
+    parent_layer = {'middle': 'top', 'bottom': 'middle'}
+    dropped_middle_limit = 10000
 
     def __init__(self, allowed_feature=None):
         self.allowed_feature = allowed_feature
         self.features = {"top": {}, "middle": {}, "bottom": {}}
+        self._dropped_middle = OrderedDict()
+        self._dropped_middle_evicted = False
+        self._pending_bottom = dict()
 
     def add_feature(self, model_layer, gff_id, parent_id=None):
+        if self.allowed_feature is not None and not self._is_allowed(model_layer, gff_id, parent_id):
+            return
 
         if model_layer == 'top':
             self.features["top"][gff_id] = {"json": {"source": "community_GFF", "id": gff_id, "children": []}}
@@ -31,6 +105,57 @@ class GenomicFeatureModel:
         elif model_layer == 'bottom':
             self.features["bottom"][gff_id] = {"parent": parent_id, "json": {"id": gff_id}}
 
+    def _is_allowed(self, model_layer, gff_id, parent_id):
+        """
+        A middle layer feature is kept when its parent is allowed. A bottom layer feature below a middle
+        layer is kept until its parent is seen, so children that appear before their parent are handled.
+        Only the last dropped_middle_limit dropped middle layer ids are remembered, see _drop_pending_bottom
+        for the bottom layer features still pending when the model is built.
+        """
+        if model_layer == 'top':
+            return gff_id in self.allowed_feature
+        if self.parent_layer[model_layer] == 'top':
+            allowed = parent_id in self.allowed_feature
+            if model_layer == 'middle':
+                self._resolve_pending(gff_id, allowed)
+            return allowed
+        if parent_id in self.features['middle']:
+            return True
+        if parent_id in self._dropped_middle:
+            return False
+        self._pending_bottom.setdefault(parent_id, list()).append(gff_id)
+        return True
+
+    def _resolve_pending(self, middle_id, allowed):
+        pending_bottom = self._pending_bottom.pop(middle_id, list())
+        if not allowed:
+            self._dropped_middle[middle_id] = None
+            if len(self._dropped_middle) > self.dropped_middle_limit:
+                self._dropped_middle.popitem(last=False)
+                self._dropped_middle_evicted = True
+            for bottom_id in pending_bottom:
+                self.features["bottom"].pop(bottom_id, None)
+
+    def _drop_pending_bottom(self):
+        """
+        Bottom layer features whose parent never turned up are left to build_model, which reports them as
+        orphans. Once older dropped middle layer ids were forgotten such a parent may have been filtered out,
+        so the features are dropped and reported instead.
+        """
+        if self._dropped_middle_evicted:
+            for parent_id, bottom_ids in self._pending_bottom.items():
+                for bottom_id in bottom_ids:
+                    print('Dropped {}, its parent {} was not found or is not allowed'.format(bottom_id, parent_id))
+                    self.features["bottom"].pop(bottom_id, None)
+        self._pending_bottom = dict()
+
+    def clear_features(self):
+        """Drop the features of the models already built, used when the GFF is read as a stream"""
+        self.features = {"top": {}, "middle": {}, "bottom": {}}
+        self._dropped_middle = OrderedDict()
+        self._dropped_middle_evicted = False
+        self._pending_bottom = dict()
+
 
 class Gene(GenomicFeatureModel):
     """Class for the biotype Gene"""
@@ -45,6 +170,7 @@ class Gene(GenomicFeatureModel):
 
     def build_model(self):
         finished_models = list()
+        self._drop_pending_bottom()
         for gff_id, model in self.features["bottom"].items():
             parent_middle_id = model["parent"]
             if parent_middle_id in self.features['middle']:
@@ -68,6 +194,7 @@ class Gene(GenomicFeatureModel):
 class PseudoGene(GenomicFeatureModel):
     """Class for the biotype pseudogene"""
     allowed_feature_type = {'pseudogene': 'top', 'pseudogenic_transcript': 'bottom'}
+    parent_layer = {'bottom': 'top'}
 
     def __init__(self, allowed_feature=None):
         super().__init__(allowed_feature)
@@ -96,6 +223,7 @@ class PseudoGene(GenomicFeatureModel):
 class NcRnaGene(GenomicFeatureModel):
     """Class for the biotype ncRNA_gene"""
     allowed_feature_type = {'ncRNA_gene': 'top', 'tRNA': 'bottom'}
+    parent_layer = {'bottom': 'top'}
 
     def __init__(self, allowed_feature=None):
         super().__init__(allowed_feature)
@@ -122,18 +250,36 @@ class NcRnaGene(GenomicFeatureModel):
 
 
 class Feature:
-    """Base class for genomic features holding stable identifier"""
+    """
+    Base class for genomic features holding stable identifier. Features use __slots__ and the
+    ancestors, status flags and known events are frozensets that start as one shared empty frozenset,
+    adding an item replaces the frozenset of the feature.
+    """
+    __slots__ = ('source_id', 'allocated_id', 'osid_id', 'ancestors', 'status_flags', 'known_events')
+    _empty = frozenset()
 
     def __init__(self, model, index):
         self.source_id = str()
         self.allocated_id = str()
         self.osid_id = int
-        self.ancestors = set()
-        self.status_flags = set()
-        self.known_events = set()
+        self.ancestors = self._empty
+        self.status_flags = self._empty
+        self.known_events = self._empty
         self.setup_model(model)
         self._register_my_self(index)
 
+    def add_ancestor(self, ancestor):
+        if ancestor not in self.ancestors:
+            self.ancestors = self.ancestors | {ancestor}
+
+    def add_status_flag(self, flag):
+        if flag not in self.status_flags:
+            self.status_flags = self.status_flags | {sys.intern(flag)}
+
+    def add_known_event(self, event_type):
+        if event_type not in self.known_events:
+            self.known_events = self.known_events | {sys.intern(event_type)}
+
     def setup_model(self, model):
         self.source_id = model['id']
 
@@ -146,11 +292,12 @@ class Feature:
 
 class ProteinCodingGene(Feature):
         """A gene is a collection of transcripts (mRNAs) and each transcript can have only one coding sequence (CDS)."""
+        __slots__ = ('mrnas', 'source')
 
         def __init__(self, model, index):
             super().__init__(model, index)
             self.mrnas = list()
-            self.source = model['source']
+            self.source = sys.intern(model['source'])
             self._create_mrna(model['children'], index)
 
         def _create_mrna(self, model, index):
@@ -170,6 +317,7 @@ class ProteinCodingGene(Feature):
 
 class MRNA(Feature):
         """A mRNA belongs to one gene, and can have 1 CDS"""
+        __slots__ = ('cds',)
 
         def __init__(self, model, index):
             super().__init__(model, index)
@@ -183,5 +331,7 @@ class MRNA(Feature):
 
 class CDS(Feature):
     """coding sequence"""
+    __slots__ = ()
+
     def setup_model(self, model):
         self.source_id = model['id'] + '-CDS'
@@ -0,0 +1,168 @@
+"""
+Copyright [2019-2020] EMBL-European Bioinformatics Institute
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+from array import array
+from urllib.parse import unquote
+"""GFF3 column 9 codec shared by event_input and event_output. Only ID and Parent are decoded."""
+
+_RESERVED_CHARACTERS = '%;=,&\t'
+_ENCODING = {character: '%{:02X}'.format(ord(character)) for character in _RESERVED_CHARACTERS}
+
+
+class GFFAttributeError(ValueError):
+    """Raised for an ID or Parent attribute that can not be decoded"""
+
+
+def value_span(attributes, key):
+    """
+    Return the (start, end) offsets of the raw value of key in the attribute column,
+    or None when the attribute is absent. Values may contain '=', fields are split on ';' only.
+    The column and key may both be str or both be bytes.
+    """
+    if isinstance(attributes, bytes):
+        key_prefix = key + b'='
+        separator = b';'
+    else:
+        key_prefix = key + '='
+        separator = ';'
+    if attributes.startswith(key_prefix):
+        start = len(key_prefix)
+    else:
+        position = attributes.find(separator + key_prefix)
+        if position == -1:
+            return None
+        start = position + 1 + len(key_prefix)
+    end = attributes.find(separator, start)
+    if end == -1:
+        end = len(attributes)
+    return start, end
+
+
+def decode_value(value):
+    if '%' in value:
+        return unquote(value)
+    return value
+
+
+def encode_value(value):
+    """Percent encode the characters with a reserved meaning in column 9"""
+    for character in _RESERVED_CHARACTERS:
+        if character in value:
+            return ''.join(_ENCODING.get(value_character, value_character) for value_character in value)
+    return value
+
+
+def extract_ids(attributes):
+    """
+    Return the ID and the list of Parents of a GFF3 attribute column, None when absent.
+    Comma separated parents are split and percent encoding is decoded.
+    """
+    gff_id = None
+    parents = None
+    id_span = value_span(attributes, 'ID')
+    if id_span is not None:
+        gff_id = attributes[id_span[0]:id_span[1]]
+        if not gff_id:
+            raise GFFAttributeError('empty ID attribute')
+        if '%' in gff_id:
+            gff_id = unquote(gff_id)
+    parent_span = value_span(attributes, 'Parent')
+    if parent_span is not None:
+        parent_value = attributes[parent_span[0]:parent_span[1]]
+        if '%' in parent_value:
+            parents = [unquote(parent) for parent in parent_value.split(',')]
+        else:
+            parents = parent_value.split(',')
+        if '' in parents:
+            raise GFFAttributeError('empty Parent attribute')
+    return gff_id, parents
+
+
+class FeatureSpanIndex:
+    """
+    Byte offsets of the ID and Parent values of the GFF feature lines that may be rewritten, recorded while
+    the GFF is parsed. Offsets are into the uncompressed GFF, values are kept as the undecoded bytes in the file.
+    The records are stored in array columns, a missing ID or Parent has a span start of -1.
+    """
+
+    def __init__(self, feature_types):
+        self.feature_types = {feature_type.encode() for feature_type in feature_types}
+        self.clear()
+
+    def clear(self):
+        self._is_cds = bytearray()
+        self._spans = array('q')
+        self._values = bytearray()
+        self._value_ends = array('Q')
+
+    def __len__(self):
+        return len(self._is_cds)
+
+    def __iter__(self):
+        """Yield (is_cds, id_span, id_value, parent_span, parent_value) of each record in file order"""
+        spans = self._spans
+        value_ends = self._value_ends
+        value_start = 0
+        for number, is_cds in enumerate(self._is_cds):
+            id_start, id_end, parent_start, parent_end = (spans[number * 4], spans[number * 4 + 1],
+                                                          spans[number * 4 + 2], spans[number * 4 + 3])
+            id_value_end, parent_value_end = value_ends[number * 2], value_ends[number * 2 + 1]
+            id_span = id_value = parent_span = parent_value = None
+            if id_start != -1:
+                id_span = (id_start, id_end)
+                id_value = bytes(self._values[value_start:id_value_end])
+            if parent_start != -1:
+                parent_span = (parent_start, parent_end)
+                parent_value = bytes(self._values[id_value_end:parent_value_end])
+            value_start = parent_value_end
+            yield bool(is_cds), id_span, id_value, parent_span, parent_value
+
+    def add_line(self, offset, line):
+        line = line.rstrip()
+        fields = line.split(b'\t')
+        if len(fields) != 9 or fields[2] not in self.feature_types:
+            return
+        record = self.get_record(offset + len(line) - len(fields[8]), fields[8], fields[2] == b'CDS')
+        if record is None:
+            return
+        is_cds, id_span, id_value, parent_span, parent_value = record
+        self._is_cds.append(is_cds)
+        self._spans.extend(id_span or (-1, -1))
+        self._spans.extend(parent_span or (-1, -1))
+        self._values += id_value or b''
+        self._value_ends.append(len(self._values))
+        self._values += parent_value or b''
+        self._value_ends.append(len(self._values))
+
+    @staticmethod
+    def get_record(column_start, attributes, is_cds):
+        """
+        Return (is_cds, id_span, id_value, parent_span, parent_value) for the attribute column starting at
+        byte offset column_start, or None when it has no ID or Parent or one of them is empty
+        """
+        id_span = value_span(attributes, b'ID')
+        parent_span = value_span(attributes, b'Parent')
+        if id_span is None and parent_span is None:
+            return None
+        id_value = None
+        parent_value = None
+        if id_span is not None:
+            id_value = attributes[id_span[0]:id_span[1]]
+            id_span = (column_start + id_span[0], column_start + id_span[1])
+        if parent_span is not None:
+            parent_value = attributes[parent_span[0]:parent_span[1]]
+            parent_span = (column_start + parent_span[0], column_start + parent_span[1])
+        if id_value == b'' or parent_value == b'' or (parent_value and b'' in parent_value.split(b',')):
+            return None
+        return is_cds, id_span, id_value, parent_span, parent_value
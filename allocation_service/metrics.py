@@ -0,0 +1,147 @@
+"""
+Copyright [2019-2020] EMBL-European Bioinformatics Institute
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import functools
+import math
+import os
+import threading
+import time
+from array import array
+"""
+In-process registry of call latencies per system, endpoint and status, exported as a Prometheus text file.
+REGISTRY is shared by the OSID service and the session database tables of a run,
+the tables are given it through their DataBaseConnection.
+"""
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float('inf'))
+METRIC_NAME = 'allocation_call_duration_seconds'
+
+
+class LatencyHistogram:
+    """Cumulative Prometheus buckets for the export and every sample for exact percentiles"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.total = 0.0
+        self.samples = array('d')
+
+    def observe(self, seconds):
+        self.samples.append(seconds)
+        self.total += seconds
+        for position, upper_bound in enumerate(self.buckets):
+            if seconds <= upper_bound:
+                self.bucket_counts[position] += 1
+
+    @property
+    def count(self):
+        return len(self.samples)
+
+    def percentile(self, percent):
+        """Nearest rank percentile of the samples, None without samples"""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        rank = max(1, math.ceil(percent / 100 * len(ordered)))
+        return ordered[rank - 1]
+
+
+class MetricsRegistry:
+
+    def __init__(self):
+        self.histograms = dict()
+        self._lock = threading.Lock()
+
+    def observe(self, system, endpoint, status, seconds):
+        key = (system, endpoint, str(status))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = LatencyHistogram()
+            self.histograms[key].observe(seconds)
+
+    def timed(self, system, endpoint):
+        """Decorator recording the latency of each call, see time_call"""
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                return self.time_call(system, endpoint, function, *args, **kwargs)
+            return wrapper
+        return decorator
+
+    def time_call(self, system, endpoint, function, *args, **kwargs):
+        """
+        Call function and record its latency. The status is ok, false for the False
+        the session database tables return on a rejected or failed call, or the exception name
+        """
+        start = time.perf_counter()
+        status = 'ok'
+        try:
+            result = function(*args, **kwargs)
+            if result is False:
+                status = 'false'
+            return result
+        except Exception as call_error:
+            status = type(call_error).__name__
+            raise
+        finally:
+            self.observe(system, endpoint, status, time.perf_counter() - start)
+
+    def clear(self):
+        with self._lock:
+            self.histograms = dict()
+
+    def summary(self, percentiles=(50, 90, 99)):
+        """Rows of system, endpoint, status, count, total seconds and the percentiles in seconds"""
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            return [key + (histogram.count, histogram.total) +
+                    tuple(histogram.percentile(percent) for percent in percentiles)
+                    for key, histogram in histograms]
+
+    def print_summary(self):
+        if not self.histograms:
+            return
+        print('{:<18} {:<36} {:<8} {:>8} {:>10} {:>9} {:>9} {:>9}'.format(
+            'system', 'endpoint', 'status', 'calls', 'total s', 'p50 ms', 'p90 ms', 'p99 ms'))
+        for system, endpoint, status, count, total, p50, p90, p99 in self.summary():
+            print('{:<18} {:<36} {:<8} {:>8} {:>10.2f} {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+                system, endpoint, status, count, total, p50 * 1000, p90 * 1000, p99 * 1000))
+
+    def prometheus_text(self):
+        lines = ['# HELP {} Latency of the OSID and session database calls'.format(METRIC_NAME),
+                 '# TYPE {} histogram'.format(METRIC_NAME)]
+        with self._lock:
+            for (system, endpoint, status), histogram in sorted(self.histograms.items()):
+                labels = 'system="{}",endpoint="{}",status="{}"'.format(
+                    _escape_label(system), _escape_label(endpoint), _escape_label(status))
+                for upper_bound, bucket_count in zip(histogram.buckets, histogram.bucket_counts):
+                    bound = '+Inf' if upper_bound == float('inf') else repr(upper_bound)
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(METRIC_NAME, labels, bound, bucket_count))
+                lines.append('{}_sum{{{}}} {!r}'.format(METRIC_NAME, labels, histogram.total))
+                lines.append('{}_count{{{}}} {}'.format(METRIC_NAME, labels, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """Write the text file in one replace, so the node exporter textfile collector never reads half of it"""
+        temp_file = path + '.tmp'
+        with open(temp_file, 'w') as file:
+            file.write(self.prometheus_text())
+        os.replace(temp_file, path)
+
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REGISTRY = MetricsRegistry()
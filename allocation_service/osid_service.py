@@ -12,48 +12,123 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import json
+import os
+import re
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from allocation_service.run_report import RunReport
+from allocation_service.metrics import REGISTRY
 """class to interact with the OSID REST service"""
 
 
+class OSIDServiceError(Exception):
+    """Raised when the OSID service does not answer a request with 200 OK"""
+
+
 class OSIDService:
-    def __init__(self, config):
+    retry_status = (500, 502, 503, 504)
+
+    def __init__(self, config, report=None):
         self.config = config
+        self.report = report or RunReport()
         self.url_base = self.config['OSID']['url']
         self.user = self.config['OSID']['user']
         self.password = self.config['OSID']['pass']
+        pool_size = self.config['OSID'].getint('pool_size', fallback=10)
+        retries = self.config['OSID'].getint('retries', fallback=3)
+        backoff_factor = self.config['OSID'].getfloat('backoff_factor', fallback=0.5)
+        self.timeout = (self.config['OSID'].getfloat('connect_timeout', fallback=10),
+                        self.config['OSID'].getfloat('read_timeout', fallback=300))
+        self.http_session = self._create_http_session(pool_size, retries, backoff_factor)
+        self.organism_cache_file = self.config['OSID'].get('organism_cache', fallback='')
+        self.organism_cache_ttl = self.config['OSID'].getint('organism_cache_ttl', fallback=30 * 24 * 3600)
+        self.organism_index = self._load_organism_cache()
+        self._organism_lock = threading.Lock()
+
+    def _create_http_session(self, pool_size, retries, backoff_factor):
+        """
+        A shared keep-alive session with a connection pool. Only the idempotent GET calls
+        are retried, with exponential backoff, a failed POST or PATCH is reported at once
+        """
+        retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=self.retry_status,
+                      allowed_methods=frozenset(['GET']), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        http_session = requests.Session()
+        http_session.auth = (self.user, self.password)
+        http_session.mount('http://', adapter)
+        http_session.mount('https://', adapter)
+        return http_session
+
+    def _request(self, method, url, **kwargs):
+        """The latency of each call is recorded by method, path with the idSet id as {id} and HTTP status"""
+        self.report.count('http_calls')
+        self.report.count('http_calls.' + method)
+        endpoint = method + ' ' + re.sub(r'/\d+', '/{id}', url[len(self.url_base):])
+        start = time.perf_counter()
+        try:
+            response = self.http_session.request(method, url, timeout=self.timeout, **kwargs)
+        except requests.RequestException as request_error:
+            REGISTRY.observe('osid', endpoint, type(request_error).__name__, time.perf_counter() - start)
+            raise
+        REGISTRY.observe('osid', endpoint, response.status_code, time.perf_counter() - start)
+        if response.status_code != requests.codes.ok:
+            raise OSIDServiceError('{} {} returned {}: {}'.format(method, url, response.status_code, response.text))
+        return response.json()
 
     def get_organism_id(self, organism_name):
-        url = self.url_base + 'organisms'
-        webservice_data = {"organismName": organism_name}
-        response = requests.get(url, params=webservice_data, auth=(self.user, self.password))
-        if response.status_code == requests.codes.ok:
-            return response.json()[0]["organismId"]
-        else:
-            print(response.text)
-            return False
+        with self._organism_lock:
+            if organism_name in self.organism_index:
+                return self.organism_index[organism_name]["organismId"]
+            url = self.url_base + 'organisms'
+            webservice_data = {"organismName": organism_name}
+            organism_id = self._request('GET', url, params=webservice_data)[0]["organismId"]
+            self.organism_index[organism_name] = {"organismId": organism_id, "time": time.time()}
+            self._save_organism_cache()
+            return organism_id
+
+    def _load_organism_cache(self):
+        """
+        Read the organism ids from the on-disk cache, dropping entries older than the TTL.
+        A cache written for another OSID url is ignored, and replaced by the next save
+        """
+        if not self.organism_cache_file or not os.path.exists(self.organism_cache_file):
+            return dict()
+        try:
+            with open(self.organism_cache_file, 'r') as file:
+                cache = json.load(file)
+        except (OSError, ValueError) as cache_error:
+            print('Ignoring organism cache {}: {}'.format(self.organism_cache_file, cache_error))
+            return dict()
+        if not isinstance(cache, dict) or cache.get('url') != self.url_base:
+            print('Ignoring organism cache {}, it was not written for {}'.format(self.organism_cache_file,
+                                                                                 self.url_base))
+            return dict()
+        oldest = time.time() - self.organism_cache_ttl
+        return {name: entry for name, entry in cache['organisms'].items() if entry["time"] >= oldest}
+
+    def _save_organism_cache(self):
+        if not self.organism_cache_file:
+            return
+        temp_file = self.organism_cache_file + '.tmp'
+        with open(temp_file, 'w') as file:
+            json.dump({'url': self.url_base, 'organisms': self.organism_index}, file)
+        os.replace(temp_file, self.organism_cache_file)
 
     def get_gene_id(self, organism_id, generate_genes):
         url = self.url_base + 'idSets'
         webservice_data = {"organismId": organism_id, "generateGenes": generate_genes}
-        response = requests.post(url, auth=(self.user, self.password), json=webservice_data)
-        if response.status_code == requests.codes.ok:
-            return response.json()["idSetId"], response.json()["generatedIds"]
-        else:
-            print(response.text)
-            return False
+        result = self._request('POST', url, json=webservice_data)
+        return result["idSetId"], result["generatedIds"]
 
     def get_transcripts(self, id_set_id, transcript_patch):
         url = self.url_base + 'idSets/' + str(id_set_id)
-        webservice_data = transcript_patch
-        response = requests.patch(url, auth=(self.user, self.password), json=webservice_data)
-        if response.status_code == requests.codes.ok:
-            result = requests.get(url, auth=(self.user, self.password))
-            if result.status_code == requests.codes.ok:
-                return result.json()["generatedIds"]
-            else:
-                print(result.text)
-                return False
-        else:
-            print(response.text)
-            return False
+        self._request('PATCH', url, json=transcript_patch)
+        return self.get_id_set(id_set_id)
+
+    def get_id_set(self, id_set_id):
+        url = self.url_base + 'idSets/' + str(id_set_id)
+        return self._request('GET', url)["generatedIds"]
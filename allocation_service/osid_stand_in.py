@@ -0,0 +1,213 @@
+"""
+Copyright [2019-2020] EMBL-European Bioinformatics Institute
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+"""Local stand-in for the OSID REST service, used to test and benchmark the pipelines without network access"""
+
+
+class OSIDStandIn:
+    """
+    Implements the organisms, idSets POST, idSets/{id} PATCH and idSets/{id} GET endpoints
+    used by OSIDService. IDs are generated sequentially and idSets are kept in memory.
+    latency is added to every request, error_rate is the fraction of requests answered
+    with 503 and max_requests_per_second throttles the server, 0 means no limit.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, prefix='OSID', latency=0.0, error_rate=0.0,
+                 max_requests_per_second=0):
+        self.prefix = prefix
+        self.latency = latency
+        self.error_rate = error_rate
+        self.max_requests_per_second = max_requests_per_second
+        self.organisms = dict()
+        self.id_sets = dict()
+        self.transcript_count = dict()
+        self.gene_count = 0
+        self.request_count = dict()
+        self._lock = threading.Lock()
+        self._next_request_time = 0.0
+        self._random = random.Random(0)
+        self._thread = None
+        self.server = ThreadingHTTPServer((host, port), self._create_handler())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return 'http://{}:{}/'.format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+    def get_organism(self, organism_name):
+        with self._lock:
+            if organism_name not in self.organisms:
+                self.organisms[organism_name] = len(self.organisms) + 1
+            return [{"organismId": self.organisms[organism_name], "organismName": organism_name}]
+
+    def post_id_set(self, body):
+        with self._lock:
+            id_set_id = len(self.id_sets) + 1
+            genes = list()
+            for _ in range(int(body["generateGenes"])):
+                self.gene_count += 1
+                gene_id = '{}{:08d}'.format(self.prefix, self.gene_count)
+                genes.append({"geneId": gene_id, "transcripts": [], "proteins": []})
+                self.transcript_count[gene_id] = 0
+            self.id_sets[id_set_id] = {"organismId": body["organismId"], "genes": genes}
+            return {"idSetId": id_set_id, "generatedIds": genes}
+
+    def patch_id_set(self, id_set_id, body):
+        with self._lock:
+            if id_set_id not in self.id_sets:
+                return None
+            genes = {gene["geneId"]: gene for gene in self.id_sets[id_set_id]["genes"]}
+            for patch in body:
+                gene_id = patch["geneId"]
+                if gene_id not in genes:
+                    genes[gene_id] = {"geneId": gene_id, "transcripts": [], "proteins": []}
+                    self.id_sets[id_set_id]["genes"].append(genes[gene_id])
+                for _ in range(int(patch["transcripts"])):
+                    self.transcript_count[gene_id] = self.transcript_count.get(gene_id, 0) + 1
+                    number = self.transcript_count[gene_id]
+                    genes[gene_id]["transcripts"].append('{}_R{:03d}'.format(gene_id, number))
+                    genes[gene_id]["proteins"].append('{}_P{:03d}'.format(gene_id, number))
+            return {"idSetId": id_set_id}
+
+    def get_id_set(self, id_set_id):
+        with self._lock:
+            if id_set_id not in self.id_sets:
+                return None
+            return {"idSetId": id_set_id, "generatedIds": self.id_sets[id_set_id]["genes"]}
+
+    def _throttle(self, endpoint):
+        with self._lock:
+            self.request_count[endpoint] = self.request_count.get(endpoint, 0) + 1
+            fail = self._random.random() < self.error_rate
+            wait = 0.0
+            if self.max_requests_per_second:
+                now = time.monotonic()
+                request_time = max(self._next_request_time, now)
+                self._next_request_time = request_time + 1.0 / self.max_requests_per_second
+                wait = request_time - now
+        if wait or self.latency:
+            time.sleep(wait + self.latency)
+        return fail
+
+    def _create_handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                path = urlparse(self.path)
+                if path.path.endswith('/organisms'):
+                    organism_name = parse_qs(path.query).get('organismName', [''])[0]
+                    self._reply('organisms GET', lambda: stand_in.get_organism(organism_name))
+                elif '/idSets/' in path.path:
+                    id_set_id = self._id_set_id(path.path)
+                    self._reply('idSets GET', lambda: stand_in.get_id_set(id_set_id))
+                else:
+                    self._send(404, {"error": "unknown endpoint"})
+
+            def do_POST(self):
+                body = self._read_body()
+                if urlparse(self.path).path.endswith('/idSets'):
+                    self._reply('idSets POST', lambda: stand_in.post_id_set(body))
+                else:
+                    self._send(404, {"error": "unknown endpoint"})
+
+            def do_PATCH(self):
+                body = self._read_body()
+                path = urlparse(self.path).path
+                if '/idSets/' in path:
+                    id_set_id = self._id_set_id(path)
+                    self._reply('idSets PATCH', lambda: stand_in.patch_id_set(id_set_id, body))
+                else:
+                    self._send(404, {"error": "unknown endpoint"})
+
+            @staticmethod
+            def _id_set_id(path):
+                try:
+                    return int(path.rstrip('/').rsplit('/', 1)[1])
+                except ValueError:
+                    return None
+
+            def _read_body(self):
+                length = int(self.headers.get('Content-Length', 0))
+                if length == 0:
+                    return None
+                return json.loads(self.rfile.read(length))
+
+            def _reply(self, endpoint, handle_request):
+                if stand_in._throttle(endpoint):
+                    self._send(503, {"error": "injected error"})
+                    return
+                result = handle_request()
+                if result is None:
+                    self._send(404, {"error": "unknown idSet"})
+                else:
+                    self._send(200, result)
+
+            def _send(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, log_format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the OSID REST service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--prefix', default='OSID', help='prefix of the generated gene ids')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    parser.add_argument('--max-requests-per-second', type=float, default=0, help='0 means no limit')
+    arguments = parser.parse_args()
+
+    osid_stand_in = OSIDStandIn(arguments.host, arguments.port, arguments.prefix, arguments.latency,
+                                arguments.error_rate, arguments.max_requests_per_second)
+    print('OSID stand-in listening on ' + osid_stand_in.url)
+    try:
+        osid_stand_in.server.serve_forever()
+    except KeyboardInterrupt:
+        osid_stand_in.server.server_close()
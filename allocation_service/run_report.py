@@ -0,0 +1,92 @@
+"""
+Copyright [2019-2020] EMBL-European Bioinformatics Institute
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import cProfile
+import json
+import os
+import platform
+import threading
+import time
+from contextlib import contextmanager
+from sqlalchemy import event
+"""Stage timings and counters of a pipeline run, written as a JSON run report"""
+
+
+class RunReport:
+    """
+    Stages are timed in wall clock and process CPU seconds, stages of concurrent allocations overlap.
+    Counters are summed across threads. With a profile path the main thread is profiled with cProfile
+    from the start of the run and the stats are dumped by finish.
+    """
+
+    def __init__(self, profile_path=None):
+        self.info = dict()
+        self.stages = list()
+        self.counters = dict()
+        self.profile_path = profile_path
+        self._lock = threading.Lock()
+        self._start_time = time.time()
+        self._start = time.perf_counter()
+        self._profiler = None
+        if self.profile_path:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            stage = {'name': name, 'start': round(start - self._start, 6),
+                     'seconds': round(time.perf_counter() - start, 6),
+                     'cpu_seconds': round(time.process_time() - cpu_start, 6)}
+            with self._lock:
+                self.stages.append(stage)
+
+    def count(self, name, number=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + number
+
+    def count_sql_statements(self, engine):
+        """Count the statements sent through a SQLAlchemy engine, an executemany is one statement"""
+        def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+            self.count('sql_statements')
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+
+    def as_dict(self):
+        with self._lock:
+            return {'info': dict(self.info, python=platform.python_version(),
+                                 started=time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(self._start_time))),
+                    'seconds': round(time.perf_counter() - self._start, 6),
+                    'stages': list(self.stages),
+                    'counters': dict(sorted(self.counters.items()))}
+
+    def finish(self, report_path=None):
+        """Stop the profiler, print the stage timings and write the report to report_path when given"""
+        if self._profiler is not None:
+            self._profiler.disable()
+            self._profiler.dump_stats(self.profile_path)
+            self._profiler = None
+        report = self.as_dict()
+        for stage in report['stages']:
+            print('{:<32} {:>10.2f} s'.format(stage['name'], stage['seconds']))
+        print('{:<32} {:>10.2f} s'.format('total', report['seconds']))
+        if report_path:
+            temp_file = report_path + '.tmp'
+            with open(temp_file, 'w') as file:
+                json.dump(report, file, indent=2)
+            os.replace(temp_file, report_path)
+        return report
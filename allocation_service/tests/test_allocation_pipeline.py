@@ -1,10 +1,36 @@
 import unittest
 import filecmp
-from allocation_service.annotation_events import EventCollection, AnnotationEvent
-from allocation_service.event_output import AnnotationEventFile
-from allocation_service.genomic_features import ProteinCodingGene, Feature
+import gzip
+import io
+import configparser
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import pymysql.cursors
+from sqlalchemy import create_engine, text
+from sqlalchemy.ext.automap import automap_base
+from sqlalchemy.pool import StaticPool
+from allocation_service.annotation_events import EventCollection, AnnotationEvent, AllocatedIdMap, EditOnlyEvent, \
+    CreateGeneModelEvent
+from allocation_service.allocation_journal import AllocationJournal
+from allocation_service.event_output import AnnotationEventFile, SessionService
+from allocation_service.genomic_features import ProteinCodingGene, Feature, Gene, PseudoGene, FeatureIdSet
 from allocation_service.event_output import GFFAnnotations
 from allocation_service.event_input import GffFilePasser
+from allocation_service import event_input
+from allocation_service import osid_service
+from allocation_service import gff_attributes
+from allocation_service import compressed_io
+from allocation_service import translation_map
+from allocation_service.translation_map import TranslationMap
+from allocation_service.osid_stand_in import OSIDStandIn
+from allocation_service.run_report import RunReport
+from allocation_service import metrics
+from session_service import rest_api
 
 
 class OSIDService:
@@ -45,6 +71,124 @@ class OSIDService:
             return [{"geneId": "ABC00015", "transcripts": ['ABC00015_R001'], "proteins": ['ABC00015_P001']}]
 
 
+class SequentialOSIDService:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.id_sets = dict()
+        self.gene_count = 0
+
+    @staticmethod
+    def get_organism_id(organism_name):
+        _ = organism_name
+        return 1
+
+    def get_gene_id(self, organism_id, generate_genes):
+        _ = organism_id
+        with self.lock:
+            id_set_id = len(self.id_sets) + 1
+            genes = list()
+            for _ in range(generate_genes):
+                self.gene_count += 1
+                genes.append({"geneId": "ABC{:05d}".format(self.gene_count), "transcripts": [], "proteins": []})
+            self.id_sets[id_set_id] = genes
+        return id_set_id, genes
+
+    def get_transcripts(self, id_set_id, transcript_patch):
+        genes = list()
+        for patch in transcript_patch:
+            genes.append({"geneId": patch['geneId'],
+                          "transcripts": [patch['geneId'] + '_R{:03d}'.format(i + 1)
+                                          for i in range(patch['transcripts'])],
+                          "proteins": [patch['geneId'] + '_P{:03d}'.format(i + 1)
+                                       for i in range(patch['transcripts'])]})
+        with self.lock:
+            self.id_sets[id_set_id] = genes
+        return genes
+
+    def get_id_set(self, id_set_id):
+        return self.id_sets[id_set_id]
+
+
+class ShortOSIDService(SequentialOSIDService):
+    """Returns one gene id less than requested"""
+    def get_gene_id(self, organism_id, generate_genes):
+        id_set_id, genes = super().get_gene_id(organism_id, generate_genes)
+        return id_set_id, genes[:-1]
+
+
+class CrashingOSIDService(SequentialOSIDService):
+    """Fails the transcript PATCH after patch_limit successful ones, as a run that dies part way"""
+    def __init__(self, patch_limit):
+        super().__init__()
+        self.patch_limit = patch_limit
+
+    def get_transcripts(self, id_set_id, transcript_patch):
+        if self.patch_limit == 0:
+            raise osid_service.OSIDServiceError('PATCH idSets/{} returned 503'.format(id_set_id))
+        self.patch_limit -= 1
+        return super().get_transcripts(id_set_id, transcript_patch)
+
+
+class LostResponseOSIDService(SequentialOSIDService):
+    """The first transcript PATCH reaches OSID but its response is lost"""
+    def __init__(self):
+        super().__init__()
+        self.patch_calls = 0
+
+    def get_transcripts(self, id_set_id, transcript_patch):
+        self.patch_calls += 1
+        genes = super().get_transcripts(id_set_id, transcript_patch)
+        if self.patch_calls == 1:
+            raise osid_service.OSIDServiceError('PATCH idSets/{} timed out'.format(id_set_id))
+        return genes
+
+
+class NewGeneEventSource:
+    def __init__(self, gene_count):
+        self.gene_count = gene_count
+
+    def get_annotations_events(self, event_type):
+        if event_type != 'new_gene':
+            return list()
+        events = list()
+        for number in range(self.gene_count):
+            gene_id = 'gene-{}'.format(number)
+            events.append([{"source": "community_GFF", "id": gene_id,
+                            "children": [{"id": gene_id + '-RA', "children": [{"id": None}]}]}])
+        return events
+
+
+class EditGeneEventSource:
+    @staticmethod
+    def get_annotations_events(event_type):
+        if event_type == 'new_gene' or event_type == 'split_gene' or event_type == 'merge_gene':
+            return list()
+        events = list()
+        for number in range(2):
+            reference_id = 'REF{}-{}'.format(number, event_type)
+            apollo_id = 'apollo{}-{}'.format(number, event_type)
+            events.append([{"source": "reference", "id": reference_id,
+                            "children": [{"id": reference_id + '-RA', "children": [{"id": None}]}]},
+                           {"source": "apollo", "id": apollo_id,
+                            "children": [{"id": apollo_id + '-RA', "children": [{"id": None}]},
+                                         {"id": apollo_id + '-RB', "children": [{"id": None}]}]}])
+        return events
+
+
+class SharedReferenceEventSource(EditGeneEventSource):
+    """gain_iso_form edits the same reference genes as change_gene"""
+    @staticmethod
+    def get_annotations_events(event_type):
+        if event_type == 'gain_iso_form':
+            events = EditGeneEventSource.get_annotations_events('change_gene')
+            for event in events:
+                event[1]['id'] = event[1]['id'].replace('change_gene', 'gain_iso_form')
+                for transcript in event[1]['children']:
+                    transcript['id'] = transcript['id'].replace('change_gene', 'gain_iso_form')
+            return events
+        return EditGeneEventSource.get_annotations_events(event_type)
+
+
 class AnnotationEventDB:
     def __init__(self, db_connection):
         self.db_connection = db_connection
@@ -101,12 +245,445 @@ class AnnotationEventDB:
             return False
 
 
+class GeneModelCursor:
+    gene_events = [{"vb_gene_id": "AARA004952", "cap_gene_id": "5d6f2e78:fd03de20", "events": "split_gene"},
+                   {"vb_gene_id": "AARA004953", "cap_gene_id": "dd6f006e", "events": "change_gene"},
+                   {"vb_gene_id": None, "cap_gene_id": "3b9c0a41", "events": "new_gene"}]
+    gene_model = [{"gene_id": "AARA004952", "transcript_id": "AARA004952_R0001"},
+                  {"gene_id": "AARA004952", "transcript_id": "AARA004952_R0002"},
+                  {"gene_id": "5d6f2e78", "transcript_id": "5d6f2e78-R"},
+                  {"gene_id": "fd03de20", "transcript_id": "fd03de20-R"}]
+
+    def __init__(self, executed_sql, cursor_class=None, read_rows=None):
+        self.executed_sql = executed_sql
+        self.cursor_class = cursor_class
+        self.read_rows = read_rows if read_rows is not None else list()
+        self.result = list()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def execute(self, sql, values):
+        self.executed_sql.append(sql)
+        if 'events in' in sql:
+            event_types = values[:len(values) // 2]
+            self.result = sorted([row for row in self.gene_events if row['events'] in event_types],
+                                 key=lambda row: event_types.index(row['events']))
+        elif 'from gene_events' in sql:
+            self.result = [row for row in self.gene_events if row['events'] == values]
+        elif 'gene_id in' in sql:
+            self.result = [row for row in self.gene_model if row['gene_id'] in values]
+        else:
+            self.result = [row for row in self.gene_model if row['gene_id'] == values]
+
+    def fetchall(self):
+        return self.result
+
+    def __iter__(self):
+        for row in self.result:
+            self.read_rows.append(row)
+            yield row
+
+
+class GeneModelConnection:
+    def __init__(self):
+        self.executed_sql = list()
+        self.cursor_classes = list()
+        self.read_rows = list()
+
+    def cursor(self, cursor_class=None):
+        self.cursor_classes.append(cursor_class)
+        return GeneModelCursor(self.executed_sql, cursor_class, self.read_rows)
+
+
+class SessionDatabase:
+    """In-memory SQLite stand-in for the session database tables SessionService writes to"""
+    metrics = None
+    tables = ["create table session (session_id integer primary key autoincrement, ses_application_id int not null, "
+              "ses_production_database_id int not null, osid_idsetid int not null unique, "
+              "data_check varchar(10) not null default 'pending', message text not null, "
+              "creation_date datetime default current_timestamp)",
+              "create table stable_identifier_record (stable_identifier_record_id integer primary key autoincrement, "
+              "stable_identifier varchar(100) not null, status varchar(10) not null default 'current', "
+              "feature_type varchar(20) not null, unique (stable_identifier, status))",
+              "create table session_identifier_action (session_identifier_action_id integer primary key "
+              "autoincrement, sia_stable_identifier_record_id int not null, sia_session_id int not null, "
+              "action varchar(10) not null, unique (sia_stable_identifier_record_id, sia_session_id))"]
+
+    def __init__(self):
+        self.engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+        self.execute(*self.tables)
+        self.base = automap_base()
+        self.base.prepare(autoload_with=self.engine)
+
+    def execute(self, *statements):
+        with self.engine.begin() as connection:
+            for statement in statements:
+                connection.execute(text(statement))
+
+    def select(self, statement):
+        with self.engine.connect() as connection:
+            return connection.execute(text(statement)).fetchall()
+
+
+class CountingSessionTable:
+    def __init__(self, session_table):
+        self.session_table = session_table
+        self.calls = dict()
+
+    def get(self, **kwargs):
+        self.calls['get'] = self.calls.get('get', 0) + 1
+        return self.session_table.get(**kwargs)
+
+    def post(self, **kwargs):
+        self.calls['post'] = self.calls.get('post', 0) + 1
+        return self.session_table.post(**kwargs)
+
+
+class CollidingId(str):
+    """Feature id with a fixed hash, to check the exact match after a hash hit"""
+
+    def __hash__(self):
+        return 42
+
+
+class FlakyOSIDHandler(BaseHTTPRequestHandler):
+    get_calls = 0
+
+    def do_GET(self):
+        FlakyOSIDHandler.get_calls += 1
+        if FlakyOSIDHandler.get_calls == 1:
+            self._reply(503, {"error": "unavailable"})
+        else:
+            self._reply(200, [{"organismId": 7}])
+
+    def do_POST(self):
+        self._reply(500, {"error": "failed"})
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, log_format, *args):
+        pass
+
+
+class OSIDServiceTestCase(unittest.TestCase):
+    def test_retry(self):
+        server = HTTPServer(('127.0.0.1', 0), FlakyOSIDHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        FlakyOSIDHandler.get_calls = 0
+        config = configparser.ConfigParser()
+        config['OSID'] = {'url': 'http://127.0.0.1:{}/'.format(server.server_port), 'user': 'test', 'pass': 'test',
+                          'retries': '2', 'backoff_factor': '0'}
+        try:
+            service = osid_service.OSIDService(config)
+            self.assertEqual(7, service.get_organism_id('test'))
+            self.assertEqual(2, FlakyOSIDHandler.get_calls)
+            with self.assertRaises(osid_service.OSIDServiceError):
+                service.get_gene_id(7, 1)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_organism_cache(self):
+        server = HTTPServer(('127.0.0.1', 0), FlakyOSIDHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        FlakyOSIDHandler.get_calls = 1
+        cache_dir = tempfile.mkdtemp()
+        config = configparser.ConfigParser()
+        config['OSID'] = {'url': 'http://127.0.0.1:{}/'.format(server.server_port), 'user': 'test', 'pass': 'test',
+                          'organism_cache': os.path.join(cache_dir, 'organisms.json')}
+        try:
+            service = osid_service.OSIDService(config)
+            self.assertEqual(7, service.get_organism_id('test'))
+            self.assertEqual(7, service.get_organism_id('test'))
+            self.assertEqual(2, FlakyOSIDHandler.get_calls)
+            service = osid_service.OSIDService(config)
+            self.assertEqual(7, service.get_organism_id('test'))
+            self.assertEqual(2, FlakyOSIDHandler.get_calls)
+            config['OSID']['organism_cache_ttl'] = '-1'
+            service = osid_service.OSIDService(config)
+            self.assertEqual(7, service.get_organism_id('test'))
+            self.assertEqual(3, FlakyOSIDHandler.get_calls)
+            del config['OSID']['organism_cache_ttl']
+            config['OSID']['url'] = 'http://localhost:{}/'.format(server.server_port)
+            service = osid_service.OSIDService(config)
+            self.assertEqual(7, service.get_organism_id('test'))
+            self.assertEqual(4, FlakyOSIDHandler.get_calls)
+        finally:
+            server.shutdown()
+            server.server_close()
+            shutil.rmtree(cache_dir)
+
+
+class OSIDStandInTestCase(unittest.TestCase):
+    def test_pipeline_against_stand_in(self):
+        with OSIDStandIn(prefix='ABC') as stand_in:
+            config = configparser.ConfigParser()
+            config['OSID'] = {'url': stand_in.url, 'user': 'test', 'pass': 'test'}
+            service = osid_service.OSIDService(config)
+            event_collection = EventCollection('test', NewGeneEventSource(30), service,
+                                               allocation_chunk_size=8, allocation_chunk_workers=2)
+            event_collection.event_types = {'new_gene'}
+            event_collection.create()
+            edit_collection = EventCollection('test', EditGeneEventSource(), service)
+            edit_collection.event_types = {'change_gene', 'gain_iso_form'}
+            edit_collection.create()
+
+        self.assertEqual(5, len(stand_in.id_sets))
+        self.assertEqual(30, stand_in.gene_count)
+        self.assertEqual(1, stand_in.request_count['organisms GET'])
+        gene_ids = {event_collection.get_allocated_id('gene-{}'.format(number)) for number in range(30)}
+        self.assertEqual({'ABC{:08d}'.format(number) for number in range(1, 31)}, gene_ids)
+        gene_id = event_collection.get_allocated_id('gene-3')
+        self.assertEqual(gene_id + '_R001', event_collection.get_allocated_id('gene-3-RA'))
+        self.assertEqual('REF0-change_gene_R002', edit_collection.get_allocated_id('apollo0-change_gene-RB'))
+
+    def test_injected_errors(self):
+        with OSIDStandIn(error_rate=1.0) as stand_in:
+            config = configparser.ConfigParser()
+            config['OSID'] = {'url': stand_in.url, 'user': 'test', 'pass': 'test',
+                              'retries': '2', 'backoff_factor': '0'}
+            service = osid_service.OSIDService(config)
+            with self.assertRaises(osid_service.OSIDServiceError):
+                service.get_organism_id('test')
+        self.assertEqual(3, stand_in.request_count['organisms GET'])
+
+
+class RunReportTestCase(unittest.TestCase):
+    def test_run_report(self):
+        report_dir = tempfile.mkdtemp()
+        try:
+            profile_file = os.path.join(report_dir, 'run.prof')
+            report = RunReport(profile_file)
+            report.info['pipeline'] = 'test'
+            with OSIDStandIn(prefix='ABC') as stand_in:
+                config = configparser.ConfigParser()
+                config['OSID'] = {'url': stand_in.url, 'user': 'test', 'pass': 'test'}
+                service = osid_service.OSIDService(config, report)
+                event_collection = EventCollection('test', NewGeneEventSource(30), service, max_concurrency=2,
+                                                   allocation_chunk_size=8, report=report)
+                event_collection.event_types = {'new_gene', 'change_gene'}
+                event_collection.create()
+            report_file = os.path.join(report_dir, 'run.json')
+            report.finish(report_file)
+            with open(report_file) as file:
+                run_report = json.load(file)
+
+            self.assertEqual('test', run_report['info']['pipeline'])
+            self.assertEqual({'event_setup.change_gene', 'event_setup.new_gene', 'journal_restore',
+                              'allocation.new_gene', 'allocation.edit_only', 'update_ancestors'},
+                             {stage['name'] for stage in run_report['stages']})
+            self.assertEqual({'created_genes': 30, 'events': 30, 'features': 90, 'http_calls': 13,
+                              'http_calls.GET': 5, 'http_calls.PATCH': 4, 'http_calls.POST': 4},
+                             run_report['counters'])
+            self.assertTrue(os.path.getsize(profile_file))
+        finally:
+            shutil.rmtree(report_dir)
+
+
+class MetricsTestCase(unittest.TestCase):
+    def test_latency_registry(self):
+        registry = metrics.MetricsRegistry()
+        for milliseconds in range(1, 101):
+            registry.observe('osid', 'GET idSets/{id}', 200, milliseconds / 1000)
+        registry.observe('osid', 'GET idSets/{id}', 503, 2.0)
+
+        @registry.timed('session_database', 'session.get')
+        def get_session(**kwargs):
+            if 'session_id' not in kwargs:
+                raise KeyError('session_id')
+            return kwargs['session_id'] or False
+
+        get_session(session_id=3)
+        get_session(session_id=0)
+        self.assertRaises(KeyError, get_session)
+        summary = {row[:3]: row[3:] for row in registry.summary()}
+        count, _, p50, p90, p99 = summary[('osid', 'GET idSets/{id}', '200')]
+        self.assertEqual((100, 0.05, 0.09, 0.099), (count, p50, p90, p99))
+        self.assertEqual(1, summary[('session_database', 'session.get', 'false')][0])
+        self.assertEqual(1, summary[('session_database', 'session.get', 'KeyError')][0])
+
+        prometheus_text = registry.prometheus_text()
+        labels = 'system="osid",endpoint="GET idSets/{id}",status="200"'
+        self.assertIn('allocation_call_duration_seconds_bucket{{{},le="0.05"}} 50\n'.format(labels), prometheus_text)
+        self.assertIn('allocation_call_duration_seconds_bucket{{{},le="+Inf"}} 100\n'.format(labels), prometheus_text)
+        self.assertIn('allocation_call_duration_seconds_count{{{}}} 100\n'.format(labels), prometheus_text)
+
+    def test_session_database_latency(self):
+        database = SessionDatabase()
+        database.metrics = metrics.MetricsRegistry()
+        session_table = rest_api.Session(database)
+        self.assertEqual(False, session_table.get(osid_idsetid=1))
+        self.assertTrue(session_table.post(application_id=1, production_database_id=1, osid_idsetid=1,
+                                           message='test'))
+        self.assertEqual({('session_database', 'session.get', 'false'): 1,
+                          ('session_database', 'session.post', 'ok'): 1},
+                         {row[:3]: row[3] for row in database.metrics.summary()})
+
+    def test_osid_latency(self):
+        metrics.REGISTRY.clear()
+        with OSIDStandIn(prefix='ABC') as stand_in:
+            config = configparser.ConfigParser()
+            config['OSID'] = {'url': stand_in.url, 'user': 'test', 'pass': 'test'}
+            event_collection = EventCollection('test', NewGeneEventSource(20), osid_service.OSIDService(config),
+                                               allocation_chunk_size=8)
+            event_collection.event_types = {'new_gene'}
+            event_collection.create()
+        calls = {row[:3]: row[3] for row in metrics.REGISTRY.summary()}
+        self.assertEqual({('osid', 'GET organisms', '200'): 1, ('osid', 'POST idSets', '200'): 3,
+                          ('osid', 'PATCH idSets/{id}', '200'): 3, ('osid', 'GET idSets/{id}', '200'): 3}, calls)
+        metrics_dir = tempfile.mkdtemp()
+        try:
+            metrics_file = os.path.join(metrics_dir, 'allocation.prom')
+            metrics.REGISTRY.write_prometheus(metrics_file)
+            with open(metrics_file) as file:
+                self.assertIn('# TYPE allocation_call_duration_seconds histogram\n', file.read())
+        finally:
+            shutil.rmtree(metrics_dir)
+            metrics.REGISTRY.clear()
+
+
 class EventInputTestCase(unittest.TestCase):
+    def test_bulk_transcripts(self):
+        connection = GeneModelConnection()
+        event_db = event_input.AnnotationEventDB(connection)
+        events = event_db.get_annotations_events('split_gene')
+        self.assertEqual(2, len(connection.executed_sql))
+        self.assertEqual(['AARA004952', '5d6f2e78', 'fd03de20'], [gene['id'] for gene in events[0]])
+        self.assertEqual(['AARA004952_R0001', 'AARA004952_R0002'],
+                         [transcript['id'] for transcript in events[0][0]['children']])
+
+        single_connection = GeneModelConnection()
+        event_db = event_input.AnnotationEventDB(single_connection, bulk_transcripts=False)
+        self.assertEqual(events, event_db.get_annotations_events('split_gene'))
+        self.assertEqual(4, len(single_connection.executed_sql))
+
+    def test_stream_event_rows(self):
+        connection = GeneModelConnection()
+        event_db = event_input.AnnotationEventDB(connection)
+        split_events = event_db.get_annotations_events('split_gene')
+        self.assertEqual(pymysql.cursors.SSDictCursor, connection.cursor_classes[0])
+        self.assertEqual([{'vb_gene_id': 'AARA004953', 'cap_gene_id': 'dd6f006e'}],
+                         event_db.get_event_rows('change_gene'))
+        change_events = event_db.get_annotations_events('change_gene')
+        self.assertEqual([], event_db.get_annotations_events('merge_gene'))
+        self.assertEqual(['AARA004952', '5d6f2e78', 'fd03de20'], [gene['id'] for gene in split_events[0]])
+        self.assertEqual(['AARA004953', 'dd6f006e'], [gene['id'] for gene in change_events[0]])
+
+    def test_load_events(self):
+        connection = GeneModelConnection()
+        transcript_connection = GeneModelConnection()
+        event_db = event_input.AnnotationEventDB(connection, transcript_connection=transcript_connection)
+        event_db.load_events(EventCollection.event_types)
+        self.assertEqual(1, len(connection.executed_sql))
+        self.assertEqual(pymysql.cursors.SSDictCursor, connection.cursor_classes[0])
+        change_events = event_db.get_annotations_events('change_gene')
+        self.assertEqual(['change_gene', 'new_gene'], [row['events'] for row in connection.read_rows])
+        self.assertEqual(1, len(transcript_connection.executed_sql))
+        self.assertEqual([], event_db.get_annotations_events('merge_gene'))
+        self.assertEqual(2, len(connection.read_rows))
+        new_events = event_db.get_annotations_events('new_gene')
+        self.assertEqual(3, len(connection.read_rows))
+        split_events = event_db.get_annotations_events('split_gene')
+        self.assertEqual(1, len(connection.executed_sql))
+        self.assertEqual(3, len(transcript_connection.executed_sql))
+        self.assertEqual([['3b9c0a41']], [[gene['id'] for gene in event] for event in new_events])
+        self.assertEqual(['AARA004952', '5d6f2e78', 'fd03de20'], [gene['id'] for gene in split_events[0]])
+        self.assertEqual(['AARA004953', 'dd6f006e'], [gene['id'] for gene in change_events[0]])
+        self.assertRaises(ValueError, event_input.AnnotationEventDB(connection).load_events,
+                          EventCollection.event_types)
+
+    def test_streaming_events_from_gff(self):
+        buffered = GffFilePasser('./test_stream_feature.gff', './stream_feature_filter', './allowed_biotype')
+        buffered_events = buffered.get_annotations_events('new_gene')
+        self.assertEqual(1, len(buffered_events))
+
+        directives = GffFilePasser('./test_stream_feature.gff', './stream_feature_filter', './allowed_biotype',
+                                   streaming='directives')
+        self.assertEqual([], directives.events)
+        directive_events = list(directives.get_annotations_events('new_gene'))
+        self.assertEqual([['DFGVE-DHETE', 'ABC0002'], ['ABC0003']],
+                         [[model['id'] for model in event] for event in directive_events])
+
+        sorted_gff = GffFilePasser('./test_stream_feature.gff', './stream_feature_filter', './allowed_biotype',
+                                   streaming='sorted')
+        sorted_events = list(sorted_gff.get_annotations_events('new_gene'))
+        self.assertEqual([['DFGVE-DHETE'], ['ABC0002'], ['ABC0003']],
+                         [[model['id'] for model in event] for event in sorted_events])
+        self.assertEqual(buffered_events[0], [model for event in sorted_events for model in event])
+
+        event_collection = EventCollection('test', sorted_gff, SequentialOSIDService())
+        event_collection.event_types = {'new_gene'}
+        event_collection.create()
+        self.assertEqual('ABC00003_R001', event_collection.get_allocated_id('ABC0003-RA'))
+
+    def test_unsorted_streaming(self):
+        gff_dir = tempfile.mkdtemp()
+        try:
+            feature_filter = os.path.join(gff_dir, 'feature_filter')
+            with open(feature_filter, 'w') as file:
+                file.write('g1\ng2\n')
+            late_child = os.path.join(gff_dir, 'late_child.gff')
+            with open(late_child, 'w') as file:
+                file.write('chr1\ttest\tgene\t10\t100\t.\t+\t.\tID=g1\n'
+                           'chr1\ttest\tmRNA\t10\t100\t.\t+\t.\tID=g1-RA;Parent=g1\n'
+                           'chr1\ttest\tgene\t200\t300\t.\t+\t.\tID=g2\n'
+                           'chr1\ttest\tCDS\t50\t90\t.\t+\t0\tID=g1-CDS;Parent=g1-RA\n')
+            self.assertEqual(['g1', 'g2'], [model['id'] for model in GffFilePasser(
+                late_child, feature_filter, './allowed_biotype').get_annotations_events('new_gene')[0]])
+            sorted_gff = GffFilePasser(late_child, feature_filter, './allowed_biotype', streaming='sorted')
+            self.assertRaises(event_input.UnsortedGFFError, list, sorted_gff.get_annotations_events('new_gene'))
+
+            unsorted_start = os.path.join(gff_dir, 'unsorted_start.gff')
+            with open(unsorted_start, 'w') as file:
+                file.write('chr1\ttest\tgene\t200\t300\t.\t+\t.\tID=g2\n'
+                           'chr1\ttest\tgene\t10\t100\t.\t+\t.\tID=g1\n'
+                           'chr1\ttest\tmRNA\t10\t100\t.\t+\t.\tID=g1-RA;Parent=g1\n'
+                           'chr1\ttest\tCDS\t50\t90\t.\t+\t0\tID=g1-CDS;Parent=g1-RA\n')
+            sorted_gff = GffFilePasser(unsorted_start, feature_filter, './allowed_biotype', streaming='sorted')
+            self.assertEqual([['g2', 'g1']], [[model['id'] for model in event]
+                                              for event in sorted_gff.get_annotations_events('new_gene')])
+        finally:
+            shutil.rmtree(gff_dir)
+
+    def test_feature_type_dispatch(self):
+        class CountingGffFilePasser(GffFilePasser):
+            parsed_lines = 0
+
+            def _extract_ids(self):
+                CountingGffFilePasser.parsed_lines += 1
+                return super()._extract_ids()
+
+        gff = CountingGffFilePasser('./test_stream_feature.gff', './stream_feature_filter', './allowed_biotype')
+        self.assertEqual(9, CountingGffFilePasser.parsed_lines)
+        self.assertEqual({'gene', 'mRNA', 'CDS'}, set(gff._feature_observers))
+        self.assertEqual(3, len(gff.get_annotations_events('new_gene')[0]))
+
+    def test_bulk_transcripts_chunked(self):
+        connection = GeneModelConnection()
+        event_db = event_input.AnnotationEventDB(connection)
+        event_db.transcript_chunk_size = 1
+        event_db.load_transcripts(['AARA004953', 'dd6f006e'])
+        self.assertEqual(2, len(connection.executed_sql))
+        self.assertEqual([], event_db.add_transcripts('dd6f006e'))
+        self.assertEqual(2, len(connection.executed_sql))
+
     def test_events_from_gff(self):
-        expected_events = [[{"source": "reference",
+        expected_events = [[{"source": "community_GFF",
                              "id": 'DFGVE-DHETE',
                              "children": [{"id": 'DHEYODH-DHYERS', "children": [{"id": 'SGETFKCBW-IUDHET'}]}]}]]
-        events = GffFilePasser('./test_input_feature.gff', './feature_filter')
+        events = GffFilePasser('./test_input_feature.gff', './feature_filter', './allowed_biotype')
         observed_events = events.get_annotations_events('new_gene')
         self.assertEqual(expected_events, observed_events)
 
@@ -127,6 +704,287 @@ class CollectionTestCase(unittest.TestCase):
         event_collection.event_types = {'complex_split', 'complex_merge'}
         event_collection.create()
 
+    def test_concurrent_event_collection(self):
+        event_connection = AnnotationEventDB(None)
+        stable_id_service = OSIDService(None)
+        serial_collection = EventCollection('test', event_connection, stable_id_service)
+        serial_collection.event_types = {'merge_gene', 'complex_split', 'complex_merge'}
+        serial_collection.create()
+        concurrent_collection = EventCollection('test', event_connection, stable_id_service, max_concurrency=3)
+        concurrent_collection.event_types = {'merge_gene', 'complex_split', 'complex_merge'}
+        concurrent_collection.create()
+
+        self.assertEqual(['complex_merge', 'complex_split', 'merge_gene'],
+                         [event.event_type for event in concurrent_collection.annotation_event_list])
+        self.assertEqual(list(serial_collection.feature_index), list(concurrent_collection.feature_index))
+        for source_id in serial_collection.feature_index:
+            self.assertEqual(serial_collection.get_allocated_id(source_id),
+                             concurrent_collection.get_allocated_id(source_id))
+
+
+    def test_chunked_allocation(self):
+        stable_id_service = SequentialOSIDService()
+        event_collection = EventCollection('test', NewGeneEventSource(25), stable_id_service,
+                                           allocation_chunk_size=10, allocation_chunk_workers=3)
+        event_collection.event_types = {'new_gene'}
+        event_collection.create()
+
+        self.assertEqual(3, len(stable_id_service.id_sets))
+        allocated_ids = {event_collection.get_allocated_id('gene-{}'.format(number)) for number in range(25)}
+        self.assertEqual(25, len(allocated_ids))
+        self.assertEqual(25, len(event_collection.annotation_event_list[0].allocated_index))
+        gene = event_collection.feature_index['gene-24']
+        self.assertEqual(event_collection.feature_index['gene-20'].osid_id, gene.osid_id)
+        self.assertNotEqual(event_collection.feature_index['gene-0'].osid_id, gene.osid_id)
+        self.assertEqual(gene.allocated_id + '_R001', event_collection.get_allocated_id('gene-24-RA'))
+        self.assertEqual(gene.allocated_id + '_P001', event_collection.get_allocated_id('gene-24-RA-CDS'))
+
+
+    def test_short_id_set(self):
+        for allocation_chunk_size in (0, 10):
+            event_collection = EventCollection('test', NewGeneEventSource(25), ShortOSIDService(),
+                                               allocation_chunk_size=allocation_chunk_size)
+            event_collection.event_types = {'new_gene'}
+            self.assertRaises(osid_service.OSIDServiceError, event_collection.create)
+
+    def test_coalesce_edit_only_events(self):
+        stable_id_service = SequentialOSIDService()
+        event_collection = EventCollection('test', EditGeneEventSource(), stable_id_service)
+        event_collection.event_types = {'change_gene', 'gain_iso_form', 'lost_iso_form'}
+        event_collection.create()
+
+        self.assertEqual(1, len(stable_id_service.id_sets))
+        self.assertEqual(6, len(stable_id_service.id_sets[1]))
+        for event_type in event_collection.event_types:
+            self.assertEqual('REF1-' + event_type, event_collection.get_allocated_id('apollo1-' + event_type))
+            self.assertEqual('REF1-{}_R002'.format(event_type),
+                             event_collection.get_allocated_id('apollo1-{}-RB'.format(event_type)))
+
+        stable_id_service = SequentialOSIDService()
+        event_collection = EventCollection('test', SharedReferenceEventSource(), stable_id_service)
+        event_collection.event_types = {'change_gene', 'gain_iso_form'}
+        event_collection.create()
+        self.assertEqual(2, len(stable_id_service.id_sets))
+        self.assertEqual(['REF0-change_gene', 'REF1-change_gene'],
+                         [gene['geneId'] for gene in stable_id_service.id_sets[1]])
+        genes = [event_collection.feature_index['apollo1-' + event_type] for event_type in ('change_gene',
+                                                                                          'gain_iso_form')]
+        self.assertEqual([(1, 'REF1-change_gene'), (2, 'REF1-change_gene')],
+                         [(gene.osid_id, gene.allocated_id) for gene in genes])
+
+        gene_patches = EditOnlyEvent('change_gene', 'test', EditGeneEventSource(), stable_id_service)
+        gene_patches.setup(dict())
+        self.assertEqual([{'geneId': 'REF0-change_gene', 'transcripts': 2},
+                          {'geneId': 'REF1-change_gene', 'transcripts': 2}],
+                         [patch for _, patch in gene_patches.get_transcript_patch()])
+        self.assertEqual(['', ''], [gene.allocated_id for gene in gene_patches.created_genes])
+        self.assertEqual(dict(), gene_patches.allocated_index)
+
+        stable_id_service = SequentialOSIDService()
+        event_collection = EventCollection('test', EditGeneEventSource(), stable_id_service)
+        event_collection.coalesce_edit_only_events = False
+        event_collection.event_types = {'change_gene', 'gain_iso_form', 'lost_iso_form'}
+        event_collection.create()
+        self.assertEqual(3, len(stable_id_service.id_sets))
+
+
+class AllocationJournalTestCase(unittest.TestCase):
+    def test_resume_allocation(self):
+        journal_dir = tempfile.mkdtemp()
+        try:
+            journal_file = os.path.join(journal_dir, 'allocation.journal')
+            stable_id_service = CrashingOSIDService(1)
+            journal = AllocationJournal(journal_file)
+            event_collection = EventCollection('test', NewGeneEventSource(25), stable_id_service,
+                                               allocation_chunk_size=10, journal=journal)
+            event_collection.event_types = {'new_gene'}
+            self.assertRaises(osid_service.OSIDServiceError, event_collection.create)
+            journal.close()
+            first_gene_id = event_collection.get_allocated_id('gene-0')
+            with open(journal_file, 'a') as file:
+                file.write('{"record": "session", "osid')
+
+            stable_id_service.patch_limit = -1
+            journal = AllocationJournal(journal_file, resume=True)
+            self.assertEqual({'gene-{}'.format(number) for number in range(25)}, journal.restored_source_ids)
+            self.assertEqual([None, None], [journal.id_sets[id_set_id]['generated_ids'] for id_set_id in (2, 3)])
+            event_collection = EventCollection('test', NewGeneEventSource(25), stable_id_service,
+                                               allocation_chunk_size=10, journal=journal)
+            event_collection.event_types = {'new_gene'}
+            event_collection.create()
+            journal.close()
+
+            self.assertEqual(3, len(stable_id_service.id_sets))
+            self.assertEqual(first_gene_id, event_collection.get_allocated_id('gene-0'))
+            allocated_ids = {event_collection.get_allocated_id('gene-{}'.format(number)) for number in range(25)}
+            self.assertEqual(25, len(allocated_ids))
+            for number in (0, 15, 24):
+                gene = event_collection.feature_index['gene-{}'.format(number)]
+                self.assertEqual(gene.allocated_id + '_R001',
+                                 event_collection.get_allocated_id('gene-{}-RA'.format(number)))
+            self.assertEqual(3, len(AllocationJournal(journal_file, resume=True).id_sets))
+        finally:
+            shutil.rmtree(journal_dir)
+
+    def test_resume_after_lost_patch(self):
+        journal_dir = tempfile.mkdtemp()
+        try:
+            journal_file = os.path.join(journal_dir, 'allocation.journal')
+            stable_id_service = LostResponseOSIDService()
+            event_collection = EventCollection('test', NewGeneEventSource(5), stable_id_service,
+                                               journal=AllocationJournal(journal_file))
+            event_collection.event_types = {'new_gene'}
+            self.assertRaises(osid_service.OSIDServiceError, event_collection.create)
+            event_collection.journal.close()
+
+            journal = AllocationJournal(journal_file, resume=True)
+            event_collection = EventCollection('test', NewGeneEventSource(5), stable_id_service, journal=journal)
+            event_collection.event_types = {'new_gene'}
+            event_collection.create()
+            journal.close()
+            self.assertEqual(1, stable_id_service.patch_calls)
+            self.assertEqual('ABC00005_R001', event_collection.get_allocated_id('gene-4-RA'))
+            self.assertEqual(5, len(AllocationJournal(journal_file, resume=True).id_sets[1]['generated_ids']))
+        finally:
+            shutil.rmtree(journal_dir)
+
+    def test_resume_edit_only(self):
+        journal_dir = tempfile.mkdtemp()
+        try:
+            journal_file = os.path.join(journal_dir, 'allocation.journal')
+            stable_id_service = CrashingOSIDService(0)
+            event_collection = EventCollection('test', EditGeneEventSource(), stable_id_service,
+                                               journal=AllocationJournal(journal_file))
+            event_collection.event_types = {'change_gene', 'gain_iso_form'}
+            self.assertRaises(osid_service.OSIDServiceError, event_collection.create)
+            event_collection.journal.close()
+
+            stable_id_service.patch_limit = -1
+            journal = AllocationJournal(journal_file, resume=True)
+            event_collection = EventCollection('test', EditGeneEventSource(), stable_id_service, journal=journal)
+            event_collection.event_types = {'change_gene', 'gain_iso_form'}
+            event_collection.create()
+            journal.close()
+            self.assertEqual(1, len(stable_id_service.id_sets))
+            self.assertEqual('REF1-gain_iso_form', event_collection.get_allocated_id('apollo1-gain_iso_form'))
+            self.assertEqual('REF1-change_gene_R002', event_collection.get_allocated_id('apollo1-change_gene-RB'))
+        finally:
+            shutil.rmtree(journal_dir)
+
+
+class SessionServiceTestCase(unittest.TestCase):
+    @staticmethod
+    def get_features(gene_count, allocation_chunk_size=0):
+        event_collection = EventCollection('test', NewGeneEventSource(gene_count), SequentialOSIDService(),
+                                           allocation_chunk_size=allocation_chunk_size)
+        event_collection.event_types = {'new_gene'}
+        event_collection.create()
+        features = list()
+        for gene in event_collection.annotation_event_list[0].created_genes:
+            features.append((gene, 'gene'))
+            features.extend((mrna, 'transcript') for mrna in gene.mrnas)
+        return features
+
+    def test_failed_chunk(self):
+        database = SessionDatabase()
+        session_service = SessionService(database, 1, 1, 'test', EventCollection('test', None, None))
+        session_service.bulk_chunk_size = 4
+        features = self.get_features(4)
+        database.execute('drop table session_identifier_action')
+        self.assertFalse(session_service.add_features(features))
+        self.assertEqual(8, database.select('select count(*) from stable_identifier_record')[0][0])
+
+        database = SessionDatabase()
+        session_service = SessionService(database, 1, 1, 'test', EventCollection('test', None, None))
+        self.assertTrue(session_service.add_features(features))
+        self.assertEqual(8, database.select('select count(*) from session_identifier_action')[0][0])
+
+    def test_resume_session_rows(self):
+        features = self.get_features(4)
+        database = SessionDatabase()
+        database.execute('drop table session_identifier_action')
+        journal_dir = tempfile.mkdtemp()
+        try:
+            journal_file = os.path.join(journal_dir, 'allocation.journal')
+            journal = AllocationJournal(journal_file)
+            session_service = SessionService(database, 1, 1, 'test', EventCollection('test', None, None),
+                                             journal=journal)
+            self.assertFalse(session_service.add_features(features))
+            journal.close()
+            database.execute(SessionDatabase.tables[2])
+            for _ in range(2):
+                journal = AllocationJournal(journal_file, resume=True)
+                session_service = SessionService(database, 1, 1, 'test', EventCollection('test', None, None),
+                                                 journal=journal)
+                self.assertTrue(session_service.add_features(features))
+                journal.close()
+                self.assertEqual(8, database.select('select count(*) from session_identifier_action')[0][0])
+            self.assertEqual(8, database.select('select count(*) from stable_identifier_record')[0][0])
+        finally:
+            shutil.rmtree(journal_dir)
+
+    def test_existing_record_not_loaded(self):
+        for bulk in (True, False):
+            features = self.get_features(2)
+            database = SessionDatabase()
+            database.execute("insert into stable_identifier_record (stable_identifier, status, feature_type) "
+                             "values ('{}', 'current', 'gene')".format(features[0][0].allocated_id))
+            session_service = SessionService(database, 1, 1, 'test', EventCollection('test', None, None), bulk)
+            if bulk:
+                session_service.add_features(features)
+            else:
+                for feature, feature_type in features:
+                    session_service.add_feature(feature, feature_type)
+            self.assertEqual([], database.select('select * from session_identifier_action '
+                                                 'where sia_stable_identifier_record_id = 1'))
+            self.assertEqual(3, database.select('select count(*) from session_identifier_action')[0][0])
+
+    def test_skip_journaled_session_rows(self):
+        journal_dir = tempfile.mkdtemp()
+        try:
+            journal_file = os.path.join(journal_dir, 'allocation.journal')
+            event_collection = EventCollection('test', NewGeneEventSource(3), SequentialOSIDService(),
+                                               journal=AllocationJournal(journal_file))
+            event_collection.event_types = {'new_gene'}
+            event_collection.create()
+            gene = event_collection.feature_index['gene-0']
+            event_collection.journal.record_session(1, 7)
+            event_collection.journal.record_session_rows([gene.allocated_id, gene.mrnas[0].allocated_id])
+            event_collection.journal.close()
+
+            journal = AllocationJournal(journal_file, resume=True)
+            database = SessionDatabase()
+            SessionService(database, 1, 1, 'test', event_collection, journal=journal)
+            journal.close()
+            self.assertEqual(0, database.select('select count(*) from session')[0][0])
+            self.assertEqual([('ABC00002',), ('ABC00002_R001',), ('ABC00003',), ('ABC00003_R001',)],
+                             database.select('select stable_identifier from stable_identifier_record '
+                                             'order by stable_identifier'))
+            self.assertEqual([(7, 4)], database.select(
+                'select sia_session_id, count(*) from session_identifier_action group by sia_session_id'))
+        finally:
+            shutil.rmtree(journal_dir)
+
+    def test_session_per_id_set(self):
+        for bulk in (True, False):
+            database = SessionDatabase()
+            database.execute("insert into session (ses_application_id, ses_production_database_id, osid_idsetid, "
+                             "message) values (1, 1, 2, 'earlier run')")
+            session_service = SessionService(database, 1, 1, 'test', EventCollection('test', None, None), bulk)
+            session_service.session_table = CountingSessionTable(session_service.session_table)
+            features = self.get_features(5, allocation_chunk_size=3)
+            session_service.bulk_chunk_size = 2
+            if bulk:
+                session_service.add_features(features)
+            else:
+                for feature, feature_type in features:
+                    session_service.add_feature(feature, feature_type)
+
+            self.assertEqual({1: 2, 2: 1}, session_service.session_index)
+            self.assertEqual({'get': 2, 'post': 1}, session_service.session_table.calls)
+            self.assertEqual([(1, 4), (2, 6)], database.select(
+                'select sia_session_id, count(*) from session_identifier_action group by sia_session_id'))
+
 
 class EventFileTestCase(unittest.TestCase):
 
@@ -175,6 +1033,81 @@ class AnnotationTestCase(unittest.TestCase):
         self.assertEqual(9, len(index), 'features register')
         self.assertEqual('reference', index['ABCD00001'].source)
 
+    def test_allocate_to_gene(self):
+        annotation_event = AnnotationEvent('new_gene', 'test_organism', None, None)
+        events = NewGeneEventSource(3).get_annotations_events('new_gene')
+        for event in events:
+            annotation_event._create_genes(event, dict())
+        annotation_event.created_genes[1].allocated_id = 'ABC00001'
+        self.assertEqual(1, annotation_event._allocate_to_gene(1, 'ABC00002'))
+        self.assertEqual(1, annotation_event._allocate_to_gene(1, 'ABC00003'))
+        self.assertEqual(None, annotation_event._allocate_to_gene(1, 'ABC00004'))
+        self.assertEqual(['ABC00002', 'ABC00001', 'ABC00003'],
+                         [gene.allocated_id for gene in annotation_event.created_genes])
+
+    def test_allocate_twice(self):
+        annotation_event = CreateGeneModelEvent('new_gene', 'test_organism', NewGeneEventSource(3),
+                                                SequentialOSIDService())
+        annotation_event.setup(dict())
+        annotation_event.get_new_stable_ids()
+        for gene in annotation_event.created_genes:
+            gene.allocated_id = str()
+        annotation_event.get_new_stable_ids()
+        self.assertEqual(['ABC00004', 'ABC00005', 'ABC00006'],
+                         [gene.allocated_id for gene in annotation_event.created_genes])
+        self.assertEqual('ABC00006_R001', annotation_event.created_genes[2].mrnas[0].allocated_id)
+
+
+class FeatureModelTestCase(unittest.TestCase):
+    def test_feature_id_set(self):
+        feature_ids = FeatureIdSet(['ABC0001', 'ABC0002'])
+        feature_ids.add('ABC0003')
+        self.assertIn('ABC0003', feature_ids)
+        self.assertNotIn('ABC0004', feature_ids)
+        self.assertEqual(3, len(feature_ids))
+
+    def test_feature_id_hash_collision(self):
+        feature_ids = FeatureIdSet([CollidingId('ABC0001'), CollidingId('ABC0002'), CollidingId('ABC0001')])
+        self.assertIn(CollidingId('ABC0002'), feature_ids)
+        self.assertNotIn(CollidingId('ABC0003'), feature_ids)
+        self.assertEqual(2, len(feature_ids))
+
+    def test_dropped_middle_limit(self):
+        gene = Gene(allowed_feature=FeatureIdSet(['ABC0001']))
+        gene.dropped_middle_limit = 1
+        gene.add_allowed_feature('gene', 'ABC0002')
+        gene.add_allowed_feature('mRNA', 'ABC0002-R1', 'ABC0002')
+        gene.add_allowed_feature('mRNA', 'ABC0002-R2', 'ABC0002')
+        gene.add_allowed_feature('CDS', 'ABC0002-R2-CDS', 'ABC0002-R2')
+        gene.add_allowed_feature('CDS', 'ABC0002-R1-CDS', 'ABC0002-R1')
+        self.assertEqual(['ABC0002-R2'], list(gene._dropped_middle))
+        self.assertEqual(['ABC0002-R1-CDS'], list(gene.features['bottom']))
+        self.assertEqual(list(), gene.build_model())
+
+    def test_filtered_orphan(self):
+        gene = Gene(allowed_feature=FeatureIdSet(['ABC0001']))
+        gene.add_allowed_feature('gene', 'ABC0001')
+        gene.add_allowed_feature('mRNA', 'ABC0001-R1', 'ABC0001')
+        gene.add_allowed_feature('CDS', 'ABC0001-R1-CDS', 'm_typo')
+        self.assertRaises(KeyError, gene.build_model)
+
+    def test_early_filter(self):
+        gene = Gene(allowed_feature=FeatureIdSet(['DFGVE-DHETE']))
+        pseudo_gene = PseudoGene(allowed_feature=FeatureIdSet(['DFGVE-DHETE']))
+        with open('./test_filter_feature.gff') as gff_file:
+            for line in gff_file:
+                fields = line.rstrip().split("\t")
+                attribs = dict(field.split('=') for field in fields[8].split(';') if field)
+                gene.add_allowed_feature(fields[2], attribs.get('ID'), attribs.get('Parent'))
+                pseudo_gene.add_allowed_feature(fields[2], attribs.get('ID'), attribs.get('Parent'))
+        self.assertEqual(['DFGVE-DHETE'], list(gene.features['top']))
+        self.assertEqual(['DHEYODH-DHYERS'], list(gene.features['middle']))
+        self.assertEqual(['SGETFKCBW-IUDHET'], list(gene.features['bottom']))
+        self.assertEqual({"top": {}, "middle": {}, "bottom": {}}, pseudo_gene.features)
+        expected_model = [{"source": "community_GFF", "id": 'DFGVE-DHETE',
+                           "children": [{"id": 'DHEYODH-DHYERS', "children": [{"id": 'SGETFKCBW-IUDHET'}]}]}]
+        self.assertEqual(expected_model, gene.build_model())
+
 
 class FeatureTestCase(unittest.TestCase):
     def test_feature(self):
@@ -196,21 +1129,147 @@ class FeatureTestCase(unittest.TestCase):
         cds = mrna.cds
         self.assertEqual("ABCD00001_R0001-CDS", cds.source_id)
 
+    def test_lazy_containers(self):
+        index = dict()
+        model = {"source": "apollo", "id": "ABCD00003", "children": [{"id": "ABCD00003_R0001",
+                                                                      "children": [{"id": None, "version": 2}]}]}
+        gene = ProteinCodingGene(model, index)
+        self.assertEqual(False, hasattr(gene, '__dict__'))
+        self.assertIs(gene.status_flags, gene.mrnas[0].ancestors)
+        self.assertEqual(frozenset(), gene.ancestors)
+        self.assertEqual(False, 'merge_gene' in gene.known_events)
+        first_ancestor = Feature({"id": "ABCD00002"}, index)
+        second_ancestor = Feature({"id": "ABCD00001"}, index)
+        for ancestor in (first_ancestor, second_ancestor, first_ancestor):
+            gene.add_ancestor(ancestor)
+        self.assertEqual({first_ancestor, second_ancestor}, gene.ancestors)
+        gene.add_status_flag('merge_gene' + '_written_to_history_file')
+        gene.add_status_flag('merge_gene' + '_written_to_history_file')
+        self.assertEqual(frozenset({'merge_gene_written_to_history_file'}), gene.status_flags)
+        self.assertEqual(frozenset(), first_ancestor.status_flags)
+
+
+class CompressedIOTestCase(unittest.TestCase):
+    def test_compressed_gff(self):
+        gff_dir = tempfile.mkdtemp()
+        try:
+            in_gff = os.path.join(gff_dir, 'in.gff.gz')
+            with open('./test_update_feature.gff', 'rb') as gff_file, gzip.open(in_gff, 'wb') as gzip_file:
+                shutil.copyfileobj(gff_file, gzip_file)
+            events = GffFilePasser(in_gff, './feature_filter', './allowed_biotype')
+            self.assertEqual('DFGVE-DHETE', events.get_annotations_events('new_gene')[0][0]['id'])
+
+            event_collection = AllocatedIdMap({'DFGVE-DHETE': 'ABC00015', 'DHEYODH-DHYERS': 'ABC00015_R001',
+                                               'DHEYODH-DHYERS-CDS': 'ABC00015_P001'})
+            with open('./expected_update_feature.gff') as gff_file:
+                expected_gff = gff_file.read()
+            for out_name, bgzip in (('out.gff.gz', False), ('out.gff.gz', True), ('out.gff.bgz', False)):
+                out_gff = os.path.join(gff_dir, out_name)
+                GFFAnnotations(in_gff, out_gff, event_collection, bgzip=bgzip).annotate_gff()
+                with gzip.open(out_gff, 'rt') as gff_file:
+                    self.assertEqual(expected_gff, gff_file.read())
+                with open(out_gff, 'rb') as gff_file:
+                    compressed = gff_file.read()
+                self.assertEqual(bgzip or out_name.endswith('.bgz'), compressed[12:14] == b'BC')
+        finally:
+            shutil.rmtree(gff_dir)
+
+    def test_bgzf_blocks(self):
+        gff_dir = tempfile.mkdtemp()
+        try:
+            out_file = os.path.join(gff_dir, 'large.bgz')
+            data = ''.join('line {}\n'.format(number) for number in range(50000))
+            with compressed_io.open_file(out_file, 'w') as handle:
+                handle.write(data)
+            with gzip.open(out_file, 'rt') as handle:
+                self.assertEqual(data, handle.read())
+            with open(out_file, 'rb') as handle:
+                self.assertEqual(True, handle.read().endswith(compressed_io._BGZF_EOF))
+        finally:
+            shutil.rmtree(gff_dir)
+
+
+class TranslationMapTestCase(unittest.TestCase):
+    def test_translation_map(self):
+        allocated_ids = {'gene-{}'.format(number): 'ABC{:05d}'.format(number) for number in range(50)}
+        allocated_ids['g;\u00e9'] = 'ABC;99'
+        map_dir = tempfile.mkdtemp()
+        try:
+            map_file = os.path.join(map_dir, 'allocated.map')
+            translation_map.write_translation_map(map_file, allocated_ids)
+            self.assertEqual(['allocated.map'], os.listdir(map_dir))
+            with TranslationMap(map_file) as allocated_map:
+                self.assertEqual(51, len(allocated_map))
+                self.assertEqual('ABC00007', allocated_map.get_allocated_id('gene-7'))
+                self.assertEqual('ABC;99', allocated_map.get_allocated_id('g;\u00e9'))
+                self.assertEqual(None, allocated_map.get_allocated_id('gene-50'))
+                self.assertEqual(None, allocated_map.get_allocated_id(None))
+                self.assertEqual(allocated_ids, dict(allocated_map.items()))
+                self.assertEqual('ABC00049', pickle.loads(pickle.dumps(allocated_map)).get_allocated_id('gene-49'))
+
+            with open(map_file, 'r+b') as file:
+                file.write(b'NOTAMAP!')
+            self.assertRaises(translation_map.TranslationMapError, TranslationMap, map_file)
+        finally:
+            shutil.rmtree(map_dir)
+
+    def test_annotate_gff_from_translation_map(self):
+        event_connection = AnnotationEventDB(None)
+        stable_id_service = OSIDService(None)
+        event_collection = EventCollection('test', event_connection, stable_id_service)
+        event_collection.event_types = {'merge_gene'}
+        event_collection.create()
+        gff_dir = tempfile.mkdtemp()
+        try:
+            map_file = os.path.join(gff_dir, 'allocated.map')
+            event_collection.export_translation_map(map_file)
+            in_gff = os.path.join(gff_dir, 'in.gff.gz')
+            with open('./test_update_feature.gff', 'rb') as gff_file, gzip.open(in_gff, 'wb') as gzip_file:
+                shutil.copyfileobj(gff_file, gzip_file)
+            with open('./expected_update_feature.gff') as gff_file:
+                expected_gff = gff_file.read()
+            with TranslationMap(map_file) as allocated_map:
+                for input_gff in ('./test_update_feature.gff', in_gff):
+                    for mapped_translation_map in (False, True):
+                        out_gff = os.path.join(gff_dir, 'out.gff')
+                        GFFAnnotations(input_gff, out_gff, allocated_map,
+                                       mapped_translation_map=mapped_translation_map).annotate_gff()
+                        with open(out_gff) as gff_file:
+                            self.assertEqual(expected_gff, gff_file.read())
+        finally:
+            shutil.rmtree(gff_dir)
+
+
+class GFFAttributesTestCase(unittest.TestCase):
+    def test_extract_ids(self):
+        self.assertEqual(('ABC001', ['ABC001_R001']),
+                         gff_attributes.extract_ids('owner=none;Parent=ABC001_R001;ID=ABC001;Note=a=b;'))
+        self.assertEqual(('ABC001', None), gff_attributes.extract_ids('ID=ABC001'))
+        self.assertEqual((None, ['ABC001-RA', 'ABC001-RB']),
+                         gff_attributes.extract_ids('Parent=ABC001-RA,ABC001-RB;Name=exon'))
+        self.assertEqual(('ABC;001', ['ABC,002']), gff_attributes.extract_ids('ID=ABC%3B001;Parent=ABC%2C002'))
+        self.assertEqual((None, None), gff_attributes.extract_ids('Dbxref=xID=1;Name=Parent'))
+        self.assertEqual((10, 16), gff_attributes.value_span('Name=x;ID=ABC001', 'ID'))
+        with self.assertRaises(gff_attributes.GFFAttributeError):
+            gff_attributes.extract_ids('ID=;Parent=ABC001')
+        with self.assertRaises(gff_attributes.GFFAttributeError):
+            gff_attributes.extract_ids('ID=ABC001;Parent=ABC001-RA,')
+
 
 class GFFTestCase(unittest.TestCase):
 
     def test_extract_ids(self):
         ga = GFFAnnotations('', '', '')
-        ga._current_gff_line = 'KB704696    VectorBase  mRNA    767281  778992  .   +   .   owner=none;Parent=ABC001_R001;ID=ABC001;date_last_modified=2020-01-09;'
-        ga._current_fields = ['', '', 'mRNA']
+        ga._current_gff_line = "KB704696\tVectorBase\tmRNA\t767281\t778992\t.\t+\t.\towner=none;Parent=ABC001_R001;ID=ABC001;date_last_modified=2020-01-09;"
+        ga._current_fields = ga._current_gff_line.rstrip().split("\t")
         self.assertEqual(('ABC001', 'ABC001_R001'), ga._extract_ids())
 
-        ga._current_gff_line = 'KB704696        VectorBase      gene    757672  778992  .       +       .       owner=none;ID=ABC001;date_last_modified=2020-01-09;'
-        ga._current_fields[2] = 'gene'
+        ga._current_gff_line = 'KB704696\tVectorBase\tgene\t757672\t778992\t.\t+\t.\towner=none;ID=ABC001;date_last_modified=2020-01-09;'
+        ga._current_fields = ga._current_gff_line.rstrip().split("\t")
         self.assertEqual(('ABC001', None), ga._extract_ids())
 
-        ga._current_gff_line = 'KB704696        VectorBase      CDS     770336  770396  .       +       0       Parent=ABC001_R001;ID=ABC001_R001-CDS;Name='
-        ga._current_fields[2] = 'CDS'
+        ga._current_gff_line = 'KB704696\tVectorBase\tCDS\t770336\t770396\t.\t+\t0\tParent=ABC001_R001;ID=ABC001_R001-CDS;Name='
+        ga._current_fields = ga._current_gff_line.rstrip().split("\t")
         self.assertEqual(('ABC001_R001-CDS', 'ABC001_R001'), ga._extract_ids())
 
     def test_is_feature_line(self):
@@ -231,6 +1290,221 @@ class GFFTestCase(unittest.TestCase):
         ga._current_fields = ga._current_gff_line.rstrip().split("\t")
         self.assertEqual(False, ga._is_feature_line())
 
+    def test_update_feature_column_nine(self):
+        allocated_ids = AllocatedIdMap({'g1': 'ABC01', 'g1-RA': 'ABC01_R001', 'g1-RB': 'ABC01_R002',
+                                          'g1-RA-CDS': 'ABC01_P001'})
+        gff_lines = ["##gff-version 3  \n",
+                     "ctg1\tsrc\tgene\t1\t90\t.\t+\t.\tDbxref=ID=g1;ID=g1\n",
+                     "ctg1\tsrc\tmRNA\t1\t90\t.\t+\t.\tID=g1-RA;Parent=g1\n",
+                     "ctg1\tsrc\texon\t1\t90\t.\t+\t.\tParent=g1-RA,g1-RB;Name=exon\n",
+                     "ctg1\tsrc\tCDS\t1\t90\t.\t+\t0\tParent=g1-RA;ID=cds1;\n",
+                     "ctg1\tsrc\tgene\t100\t190\t.\t+\t.\tID=g2;Name=g2  \n"]
+        expected_lines = ["##gff-version 3  \n",
+                          "ctg1\tsrc\tgene\t1\t90\t.\t+\t.\tDbxref=ID=g1;ID=ABC01\n",
+                          "ctg1\tsrc\tmRNA\t1\t90\t.\t+\t.\tID=ABC01_R001;Parent=ABC01\n",
+                          "ctg1\tsrc\texon\t1\t90\t.\t+\t.\tParent=ABC01_R001,ABC01_R002;Name=exon\n",
+                          "ctg1\tsrc\tCDS\t1\t90\t.\t+\t0\tParent=ABC01_R001;ID=ABC01_P001;\n",
+                          "ctg1\tsrc\tgene\t100\t190\t.\t+\t.\tID=g2;Name=g2  \n"]
+        gff_dir = tempfile.mkdtemp()
+        try:
+            in_gff = os.path.join(gff_dir, 'in.gff')
+            out_gff = os.path.join(gff_dir, 'out.gff')
+            with open(in_gff, 'w') as gff_file:
+                gff_file.writelines(gff_lines)
+            GFFAnnotations(in_gff, out_gff, allocated_ids).annotate_gff()
+            with open(out_gff) as gff_file:
+                self.assertEqual(expected_lines, gff_file.readlines())
+        finally:
+            shutil.rmtree(gff_dir)
+
+    def test_annotate_line_endings(self):
+        allocated_ids = AllocatedIdMap({'g1': 'ABC01', 'g1-RA': 'ABC01_R001'})
+        gff_data = (b"##gff-version 3\r\n"
+                    b"ctg1\tsrc\tgene\t1\t90\t.\t+\t.\tID=g1;Name=x \r\n"
+                    b"ctg1\tsrc\tmRNA\t1\t90\t.\t+\t.\tID=g1-RA;Parent=g1\r\n"
+                    b"ctg1\tsrc\tgene\t100\t190\t.\t+\t.\tID=g2\t\r\n")
+        expected_data = (b"##gff-version 3\r\n"
+                         b"ctg1\tsrc\tgene\t1\t90\t.\t+\t.\tID=ABC01;Name=x \r\n"
+                         b"ctg1\tsrc\tmRNA\t1\t90\t.\t+\t.\tID=ABC01_R001;Parent=ABC01\r\n"
+                         b"ctg1\tsrc\tgene\t100\t190\t.\t+\t.\tID=g2\t\r\n")
+        gff_dir = tempfile.mkdtemp()
+        try:
+            in_gff = os.path.join(gff_dir, 'in.gff.gz')
+            out_gff = os.path.join(gff_dir, 'out.gff.gz')
+            with gzip.open(in_gff, 'wb') as gff_file:
+                gff_file.write(gff_data)
+            GFFAnnotations(in_gff, out_gff, allocated_ids).annotate_gff()
+            with gzip.open(out_gff, 'rb') as gff_file:
+                self.assertEqual(expected_data, gff_file.read())
+        finally:
+            shutil.rmtree(gff_dir)
+
+    def test_annotate_later_parent(self):
+        allocated_ids = AllocatedIdMap({'tx1': 'ABC01_R001', 'tx2': 'ABC01_R002'})
+        gff_data = (b"ctg1\tsrc\texon\t1\t90\t.\t+\t.\tParent=tx3,tx2\n"
+                    b"ctg1\tsrc\tCDS\t1\t90\t.\t+\t0\tID=c1;Parent=tx3,tx1\n"
+                    b"ctg1\tsrc\texon\t1\t90\t.\t+\t.\tParent=tx3,tx4;Note=a,b\n")
+        expected_data = (b"ctg1\tsrc\texon\t1\t90\t.\t+\t.\tParent=tx3,ABC01_R002\n"
+                         b"ctg1\tsrc\tCDS\t1\t90\t.\t+\t0\tID=c1;Parent=tx3,ABC01_R001\n"
+                         b"ctg1\tsrc\texon\t1\t90\t.\t+\t.\tParent=tx3,tx4;Note=a,b\n")
+        gff_dir = tempfile.mkdtemp()
+        try:
+            in_gff = os.path.join(gff_dir, 'in.gff.gz')
+            out_gff = os.path.join(gff_dir, 'out.gff.gz')
+            with gzip.open(in_gff, 'wb') as gff_file:
+                gff_file.write(gff_data)
+            GFFAnnotations(in_gff, out_gff, allocated_ids).annotate_gff()
+            with gzip.open(out_gff, 'rb') as gff_file:
+                self.assertEqual(expected_data, gff_file.read())
+        finally:
+            shutil.rmtree(gff_dir)
+
+    def test_annotate_gff_from_spans(self):
+        allocated_ids = AllocatedIdMap({'g1': 'ABC01', 'g1-RA': 'ABC01_R001', 'g1-RB': 'ABC01_R002',
+                                        'g1-RA-CDS': 'ABC01_P001', 'g%3B2': 'ABC02'})
+        gff_lines = ["##gff-version 3\n",
+                     "ctg1\tsrc\tgene\t1\t90\t.\t+\t.\tName=\u00e9t\u00e9;ID=g1\n",
+                     "ctg1\tsrc\tmRNA\t1\t90\t.\t+\t.\tID=g1-RA;Parent=g1\n",
+                     "ctg1\tsrc\texon\t1\t90\t.\t+\t.\tParent=g1-RA,g1-RB;Name=exon\n",
+                     "ctg1\tsrc\tCDS\t1\t90\t.\t+\t0\tParent=g1-RA;ID=cds1;\n",
+                     "ctg1\tsrc\tregion\t1\t900\t.\t+\t.\tID=g1\n",
+                     "ctg1\tsrc\tgene\t100\t190\t.\t+\t.\tName=g2;ID=g%253B2"]
+        gff_dir = tempfile.mkdtemp()
+        try:
+            in_gff = os.path.join(gff_dir, 'in.gff')
+            with open(in_gff, 'w', encoding='utf-8') as gff_file:
+                gff_file.writelines(gff_lines)
+            events = GffFilePasser(in_gff, './feature_filter', './allowed_biotype',
+                                   span_feature_types=GFFAnnotations.allowed_feature)
+            self.assertEqual(5, len(events.feature_spans))
+            events._load_events_from_gff(in_gff)
+            self.assertEqual(5, len(events.feature_spans))
+            self.assertEqual((True, (196, 200), b'cds1', (187, 192), b'g1-RA'), list(events.feature_spans)[3])
+            serial_gff = os.path.join(gff_dir, 'serial.gff')
+            span_gff = os.path.join(gff_dir, 'span.gff')
+            GFFAnnotations(in_gff, serial_gff, allocated_ids).annotate_gff()
+            GFFAnnotations(in_gff, span_gff, allocated_ids).annotate_gff_from_spans(events.feature_spans)
+            filecmp.clear_cache()
+            self.assertEqual(True, filecmp.cmp(serial_gff, span_gff, shallow=False))
+            with open(span_gff, encoding='utf-8') as gff_file:
+                self.assertEqual("ctg1\tsrc\tgene\t100\t190\t.\t+\t.\tName=g2;ID=ABC02\n", gff_file.readlines()[-1])
+        finally:
+            shutil.rmtree(gff_dir)
+
+    def test_mapped_annotation(self):
+        allocated_ids = AllocatedIdMap({'g1': 'ABC01', 'g1-RA': 'ABC01_R001', 'g1-RB': 'ABC01_R002',
+                                        'g1-RA-CDS': 'ABC01_P001', 'g;2': 'ABC;02'})
+        gff_lines = ["##gff-version 3\n",
+                     "ctg1\tsrc\tgene\t1\t90\t.\t+\t.\tDbxref=ID=g1;ID=g1\n",
+                     "ctg1\tsrc\tmRNA\t1\t90\t.\t+\t.\tID=g1-RA;Parent=g1\n",
+                     "ctg1\tsrc\texon\t1\t90\t.\t+\t.\tParent=g1-RA,g1-RB;Name=exon\n",
+                     "ctg1\tsrc\tCDS\t1\t90\t.\t+\t0\tParent=g1-RA;ID=cds1;\n",
+                     "ctg1\tsrc\tregion\t1\t900\t.\t+\t.\tID=g1\n",
+                     "ctg1\tsrc\tgene\t100\t190\t.\t+\t.\tID=g%3B2"]
+        gff_dir = tempfile.mkdtemp()
+        try:
+            in_gff = os.path.join(gff_dir, 'in.gff')
+            mapped_gff = os.path.join(gff_dir, 'mapped.gff')
+            with open(in_gff, 'w') as gff_file:
+                gff_file.writelines(gff_lines)
+            GFFAnnotations(in_gff, mapped_gff, allocated_ids).annotate_gff()
+            text_output = io.StringIO(newline='\n')
+            with open(in_gff, newline='\n') as gff_file:
+                GFFAnnotations(in_gff, None, allocated_ids).annotate_text(gff_file, text_output)
+            with open(mapped_gff) as gff_file:
+                mapped_lines = gff_file.readlines()
+            self.assertEqual(text_output.getvalue(), ''.join(mapped_lines))
+            self.assertEqual("ctg1\tsrc\tgene\t100\t190\t.\t+\t.\tID=ABC%3B02\n", mapped_lines[-1])
+
+            open(in_gff, 'w').close()
+            GFFAnnotations(in_gff, mapped_gff, allocated_ids).annotate_gff()
+            self.assertEqual(0, os.path.getsize(mapped_gff))
+        finally:
+            shutil.rmtree(gff_dir)
+
+    def test_parallel_annotation(self):
+        allocated_ids = dict()
+        gff_lines = ["##gff-version 3\n"]
+        for region in range(6):
+            for number in range(20):
+                gene_id = 'g{}-{}'.format(region, number)
+                allocated_ids[gene_id] = 'ABC{:02d}{:03d}'.format(region, number)
+                allocated_ids[gene_id + '-RA'] = allocated_ids[gene_id] + '_R001'
+                gff_lines.append("ctg{}\tsrc\tgene\t{}\t{}\t.\t+\t.\tID={};Name=x\n"
+                                 .format(region, number * 100 + 1, number * 100 + 90, gene_id))
+                gff_lines.append("ctg{}\tsrc\tmRNA\t{}\t{}\t.\t+\t.\tID={}-RA;Parent={}\n"
+                                 .format(region, number * 100 + 1, number * 100 + 90, gene_id, gene_id))
+                gff_lines.append("ctg{}\tsrc\tregion\t1\t9000\t.\t+\t.\tID=ctg{}\n".format(region, region))
+            if region % 2:
+                gff_lines.append("###\n")
+        gff_lines[-1] = gff_lines[-1].rstrip('\n')
+        gff_dir = tempfile.mkdtemp()
+        try:
+            in_gff = os.path.join(gff_dir, 'in.gff')
+            with open(in_gff, 'w') as gff_file:
+                gff_file.writelines(gff_lines)
+            serial_gff = os.path.join(gff_dir, 'serial.gff')
+            parallel_gff = os.path.join(gff_dir, 'parallel.gff')
+            gff_annotation = GFFAnnotations(in_gff, parallel_gff, AllocatedIdMap(allocated_ids))
+            self.assertEqual(6, len(gff_annotation._get_shards(2)))
+            gff_annotation.annotate_gff(processes=2)
+            GFFAnnotations(in_gff, serial_gff, AllocatedIdMap(allocated_ids)).annotate_gff()
+            filecmp.clear_cache()
+            self.assertEqual(True, filecmp.cmp(serial_gff, parallel_gff, shallow=False))
+            self.assertEqual(['in.gff', 'parallel.gff', 'serial.gff'], sorted(os.listdir(gff_dir)))
+        finally:
+            shutil.rmtree(gff_dir)
+
+    def test_line_endings_of_all_paths(self):
+        allocated_ids = {'ctg1': 'g1'}
+        line_templates = ["ctg{0}\tsrc\tgene\t1\t90\t.\t+\t.\tName=x ;ID={gene}\r\n",
+                          "ctg{0}\tsrc\tmRNA\t1\t90\t.\t+\t.\tID={ra};Parent={gene}  \n",
+                          "ctg{0}\tsrc\tmRNA\t1\t90\t.\t+\t.\tID={rb};Parent={gene}\r\n",
+                          "ctg{0}\tsrc\texon\t1\t90\t.\t+\t.\tParent={rb},{ra}\r\n",
+                          "ctg{0}\tsrc\tCDS\t1\t90\t.\t+\t0\tParent={ra}\t\r\n",
+                          "ctg{0}\tsrc\tCDS\t1\t90\t.\t+\t0\tID=c{0};Parent={rb},{ra} \n",
+                          "ctg{0}\tsrc\tregion\t1\t90\t.\t+\t.\tName=x \r\n"]
+        gff_lines = [b"##gff-version 3 \r\n"]
+        expected_lines = [b"##gff-version 3 \r\n"]
+        for region in range(4):
+            gene_id = 'g{}'.format(region)
+            allocated_ids[gene_id] = 'ABC{:02d}'.format(region)
+            allocated_ids[gene_id + '-RA'] = allocated_ids[gene_id] + '_R001'
+            allocated_ids[gene_id + '-RA-CDS'] = allocated_ids[gene_id] + '_P001'
+            source_ids = {'gene': gene_id, 'ra': gene_id + '-RA', 'rb': gene_id + '-RB'}
+            expected_ids = dict(source_ids)
+            if region == 1:
+                expected_ids.update(gene=allocated_ids[gene_id], ra=allocated_ids[gene_id + '-RA'])
+            for line_template in line_templates:
+                gff_lines.append(line_template.format(region, **source_ids).encode())
+                expected_lines.append(line_template.format(region, **expected_ids).encode())
+        gff_lines[-1] = gff_lines[-1].rstrip(b'\n')
+        expected_data = b''.join(expected_lines).rstrip(b'\n') + b'\n'
+        gff_dir = tempfile.mkdtemp()
+        try:
+            in_gff = os.path.join(gff_dir, 'in.gff')
+            with open(in_gff, 'wb') as gff_file:
+                gff_file.writelines(gff_lines)
+            with gzip.open(in_gff + '.gz', 'wb') as gff_file:
+                gff_file.writelines(gff_lines)
+            allocated_ids = AllocatedIdMap({source_id: allocated_id for source_id, allocated_id in allocated_ids.items()
+                                            if source_id.startswith('g1')})
+            events = GffFilePasser(in_gff, './feature_filter', './allowed_biotype',
+                                   span_feature_types=GFFAnnotations.allowed_feature)
+            paths = {'text': os.path.join(gff_dir, 'text.gff.gz'), 'mapped': os.path.join(gff_dir, 'mapped.gff'),
+                     'shards': os.path.join(gff_dir, 'shards.gff'), 'spans': os.path.join(gff_dir, 'spans.gff')}
+            GFFAnnotations(in_gff + '.gz', paths['text'], allocated_ids).annotate_gff()
+            GFFAnnotations(in_gff, paths['mapped'], allocated_ids).annotate_gff()
+            gff_annotation = GFFAnnotations(in_gff, paths['shards'], allocated_ids)
+            self.assertEqual(4, len(gff_annotation._get_shards(2)))
+            gff_annotation.annotate_gff(processes=2)
+            GFFAnnotations(in_gff, paths['spans'], allocated_ids).annotate_gff_from_spans(events.feature_spans)
+            for path_name, out_gff in paths.items():
+                with compressed_io.open_file(out_gff, 'rb') as gff_file:
+                    self.assertEqual((path_name, expected_data), (path_name, gff_file.read()))
+        finally:
+            shutil.rmtree(gff_dir)
+
     def test_update_feature(self):
         event_connection = AnnotationEventDB(None)
         stable_id_service = OSIDService(None)
@@ -0,0 +1,171 @@
+"""
+Copyright [2019-2020] EMBL-European Bioinformatics Institute
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+"""
+Frozen source id to allocated id map in a memory-mappable file, so a GFF can be annotated in a separate
+process without the gene models, OSID or the session database.
+
+Layout, 8 byte native unsigned integers: magic, byte order, count, slot count, an open addressing table
+of entry number + 1 with linear probing (0 is empty), the 64 bit hash of each source id, count + 1 offsets
+into the source id blob, count + 1 offsets into the allocated id blob, then the two UTF-8 blobs.
+"""
+
+MAGIC = b'SIDMAP01'
+_HEADER = struct.Struct('=8s8sQQ')
+
+
+class TranslationMapError(ValueError):
+    """Raised for a file that is not a translation map written on a host with the same byte order"""
+
+
+def _hash(source_id):
+    return zlib.crc32(source_id) << 32 | zlib.adler32(source_id)
+
+
+def _first_slot(source_hash, slot_bits):
+    """Fibonacci hashing, the checksums alone cluster in the low bits for short similar ids"""
+    return ((source_hash * 0x9e3779b97f4a7c15) & 0xffffffffffffffff) >> (64 - slot_bits)
+
+
+def write_translation_map(path, allocated_ids):
+    """Write the source id to allocated id dict to path, replacing the file only once it is complete"""
+    entries = sorted((source_id.encode(), allocated_id.encode()) for source_id, allocated_id in allocated_ids.items())
+    slot_bits = 1
+    while 1 << slot_bits < 2 * len(entries):
+        slot_bits += 1
+    slot_count = 1 << slot_bits
+    slots = array('Q', bytes(8 * slot_count))
+    hashes = array('Q')
+    source_offsets = array('Q', [0])
+    allocated_offsets = array('Q', [0])
+    for number, (source_id, allocated_id) in enumerate(entries):
+        source_hash = _hash(source_id)
+        slot = _first_slot(source_hash, slot_bits)
+        while slots[slot]:
+            slot = (slot + 1) & (slot_count - 1)
+        slots[slot] = number + 1
+        hashes.append(source_hash)
+        source_offsets.append(source_offsets[-1] + len(source_id))
+        allocated_offsets.append(allocated_offsets[-1] + len(allocated_id))
+
+    temp_file = path + '.tmp'
+    with open(temp_file, 'wb') as file:
+        file.write(_HEADER.pack(MAGIC, sys.byteorder.encode().ljust(8), len(entries), slot_count))
+        for table in (slots, hashes, source_offsets, allocated_offsets):
+            table.tofile(file)
+        for source_id, _ in entries:
+            file.write(source_id)
+        for _, allocated_id in entries:
+            file.write(allocated_id)
+    os.replace(temp_file, path)
+
+
+class TranslationMap:
+    """
+    Read-only view of a translation map file through a memory map, lookups probe the hash table in the
+    file. Can stand in for an EventCollection when annotating a GFF, worker processes reopen the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._open()
+
+    def _open(self):
+        with open(self.path, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, byte_order, count, slot_count = _HEADER.unpack_from(self._map)
+        if magic != MAGIC or byte_order.rstrip() != sys.byteorder.encode():
+            self._map.close()
+            raise TranslationMapError('{} is not a translation map for this host'.format(self.path))
+        self._count = count
+        self._mask = slot_count - 1
+        self._slot_bits = slot_count.bit_length() - 1
+        table_size = slot_count + 3 * count + 2
+        table = memoryview(self._map)[_HEADER.size:_HEADER.size + table_size * 8].cast('Q')
+        self._slots = table[:slot_count]
+        self._hashes = table[slot_count:slot_count + count]
+        self._source_offsets = table[slot_count + count:slot_count + 2 * count + 1]
+        self._allocated_offsets = table[slot_count + 2 * count + 1:]
+        table.release()
+        self._source_start = _HEADER.size + table_size * 8
+        self._allocated_start = self._source_start + self._source_offsets[count]
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self._open()
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, source_id):
+        return self.get(source_id) is not None
+
+    def get(self, source_id):
+        """Return the UTF-8 allocated id of the UTF-8 source id, or None"""
+        source_hash = _hash(source_id)
+        slot = _first_slot(source_hash, self._slot_bits)
+        entry = self._slots[slot]
+        while entry:
+            entry -= 1
+            if self._hashes[entry] == source_hash:
+                source_start = self._source_start + self._source_offsets[entry]
+                if self._map[source_start:self._source_start + self._source_offsets[entry + 1]] == source_id:
+                    return self._map[self._allocated_start + self._allocated_offsets[entry]:
+                                     self._allocated_start + self._allocated_offsets[entry + 1]]
+            slot = (slot + 1) & self._mask
+            entry = self._slots[slot]
+        return None
+
+    def get_allocated_id(self, source_id):
+        if source_id is None:
+            return None
+        allocated_id = self.get(source_id.encode())
+        if allocated_id is None:
+            return None
+        return allocated_id.decode()
+
+    def get_allocated_id_map(self):
+        return self
+
+    def items(self):
+        """Yield the (source id, allocated id) pairs in source id order"""
+        for position in range(self._count):
+            source_id = self._map[self._source_start + self._source_offsets[position]:
+                                  self._source_start + self._source_offsets[position + 1]]
+            allocated_id = self._map[self._allocated_start + self._allocated_offsets[position]:
+                                     self._allocated_start + self._allocated_offsets[position + 1]]
+            yield source_id.decode(), allocated_id.decode()
+
+    def close(self):
+        self._slots.release()
+        self._hashes.release()
+        self._source_offsets.release()
+        self._allocated_offsets.release()
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
@@ -0,0 +1,63 @@
+"""
+Copyright [2019-2020] EMBL-European Bioinformatics Institute
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import time
+from allocation_service.annotation_events import CreateGeneModelEvent
+"""Time per gene of new gene allocation at growing organism sizes, run: python3 -m benchmarks.allocation_scaling"""
+
+
+class InMemoryOSIDService:
+    def get_organism_id(self, organism_name):
+        return 1
+
+    def get_gene_id(self, organism_id, generate_genes):
+        return 1, [{'geneId': 'OSID{:08d}'.format(number)} for number in range(generate_genes)]
+
+    def get_transcripts(self, id_set_id, transcript_patch):
+        return [{'geneId': patch['geneId'],
+                 'transcripts': [patch['geneId'] + '_R001'] * patch['transcripts'],
+                 'proteins': [patch['geneId'] + '_P001'] * patch['transcripts']} for patch in transcript_patch]
+
+
+class ScanningCreateGeneModelEvent(CreateGeneModelEvent):
+    """The former allocation that scanned the created genes from the start for every generated id"""
+
+    def _allocate_to_gene(self, osid_id, gene_id):
+        for gene in self.created_genes:
+            if not gene.allocated_id:
+                gene.osid_id = osid_id
+                gene.allocated_id = gene_id
+                self.allocated_index[gene_id] = gene
+                return len(gene.mrnas)
+
+
+def allocation_time(event_class, number):
+    annotation_event = event_class('new_gene', 'benchmark', None, InMemoryOSIDService())
+    event = [{'id': 'gene-{}'.format(gene_number), 'source': 'apollo',
+              'children': [{'id': 'gene-{}-RA'.format(gene_number), 'children': [{'id': None}]}]}
+             for gene_number in range(number)]
+    annotation_event._create_genes(event, dict())
+    start = time.perf_counter()
+    annotation_event.get_new_stable_ids()
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    print('{:>8} {:>16} {:>16}'.format('genes', 'cursor us/gene', 'scan us/gene'))
+    for number in (1000, 10000, 100000):
+        cursor_time = allocation_time(CreateGeneModelEvent, number)
+        scan = 'skipped'
+        if number <= 10000:
+            scan = '{:.2f}'.format(allocation_time(ScanningCreateGeneModelEvent, number) / number * 1e6)
+        print('{:>8} {:>16.2f} {:>16}'.format(number, cursor_time / number * 1e6, scan))
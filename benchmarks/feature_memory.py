@@ -0,0 +1,85 @@
+"""
+Copyright [2019-2020] EMBL-European Bioinformatics Institute
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import tracemalloc
+from allocation_service.genomic_features import ProteinCodingGene
+"""Bytes per gene of the slotted features against the former __dict__ features, run: python3 -m benchmarks.feature_memory"""
+
+
+class DictFeature:
+    def __init__(self, model, index):
+        self.source_id = str()
+        self.allocated_id = str()
+        self.osid_id = int
+        self.ancestors = set()
+        self.status_flags = set()
+        self.known_events = set()
+        self.setup_model(model)
+        index[self.source_id] = self
+
+    def setup_model(self, model):
+        self.source_id = model['id']
+
+
+class DictGene(DictFeature):
+    def __init__(self, model, index):
+        super().__init__(model, index)
+        self.mrnas = list()
+        self.source = model['source']
+        for mrna_model in model['children']:
+            self.mrnas.append(DictMRNA(mrna_model, index))
+
+
+class DictMRNA(DictFeature):
+    def __init__(self, model, index):
+        super().__init__(model, index)
+        self.cds = DictCDS(model, index)
+
+
+class DictCDS(DictFeature):
+    def setup_model(self, model):
+        self.source_id = model['id'] + '-CDS'
+
+
+def gene_models(number, transcripts):
+    """Gene models as built by GffFilePasser, the source string is a fresh object per gene as read from a file"""
+    models = list()
+    for gene_number in range(number):
+        gene_id = 'GENE{:08d}'.format(gene_number)
+        children = [{'id': '{}-R{}'.format(gene_id, transcript), 'children': [{'id': None}]}
+                    for transcript in range(transcripts)]
+        models.append({'id': gene_id, 'source': ''.join(['ap', 'ollo']), 'children': children})
+    return models
+
+
+def bytes_per_gene(gene_class, models):
+    tracemalloc.start()
+    index = dict()
+    before = tracemalloc.get_traced_memory()[0]
+    genes = [gene_class(model, index) for model in models]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del genes, index
+    return (after - before) / len(models)
+
+
+if __name__ == '__main__':
+    number = 100000
+    models = gene_models(number, 2)
+    dict_bytes = bytes_per_gene(DictGene, models)
+    slot_bytes = bytes_per_gene(ProteinCodingGene, models)
+    print('genes with 2 transcripts: {}'.format(number))
+    print('__dict__ features: {:.0f} bytes/gene'.format(dict_bytes))
+    print('slotted features:  {:.0f} bytes/gene'.format(slot_bytes))
+    print('reduction:         {:.1f}x'.format(dict_bytes / slot_bytes))
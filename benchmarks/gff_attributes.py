@@ -0,0 +1,39 @@
+"""
+Copyright [2019-2020] EMBL-European Bioinformatics Institute
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import timeit
+from allocation_service import gff_attributes
+"""Micro-benchmark of the GFF attribute codec against the former split into a dict, run: python3 -m benchmarks.gff_attributes"""
+
+ATTRIBUTES = ('ID=AGAP000002-RA;Parent=AGAP000002;Name=AGAP000002-RA;biotype=protein_coding;'
+              'description=GPCR Methuselah Family;Dbxref=VectorBase:AGAP000002,GO:0004930;'
+              'owner=none;date_last_modified=2020-01-09')
+
+
+def extract_ids_with_dict(attrib_col):
+    attribs = {}
+    for field in attrib_col.split(";"):
+        if field:
+            (key, value) = field.split("=")
+            attribs[key] = value
+    return attribs.get("ID"), attribs.get("Parent")
+
+
+if __name__ == '__main__':
+    number = 200000
+    dict_time = timeit.timeit(lambda: extract_ids_with_dict(ATTRIBUTES), number=number)
+    codec_time = timeit.timeit(lambda: gff_attributes.extract_ids(ATTRIBUTES), number=number)
+    print('split into dict: {:.0f} ns/line'.format(dict_time / number * 1e9))
+    print('codec:           {:.0f} ns/line'.format(codec_time / number * 1e9))
+    print('speedup:         {:.1f}x'.format(dict_time / codec_time))
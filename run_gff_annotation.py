@@ -0,0 +1,39 @@
+"""
+Copyright [2017-2021] EMBL-European Bioinformatics Institute
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+     http://www.apache.org/licenses/LICENSE-2.0
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import configparser
+import sys
+from allocation_service.translation_map import TranslationMap
+from allocation_service.event_output import GFFAnnotations
+
+
+if __name__ == '__main__':
+    allocation_config_file = './allocation_service/allocation_pipeline.conf'
+    allocation_config = configparser.ConfigParser()
+    allocation_config.read(allocation_config_file)
+
+    input_gff_path = allocation_config['FILE']['input_gff']
+    output_gff_path = allocation_config['FILE']['output_gff']
+    translation_map_path = allocation_config['FILE'].get('translation_map', fallback='')
+    gff_processes = allocation_config['PIPELINE'].getint('gff_processes', fallback=1)
+    bgzip_output = allocation_config['FILE'].getboolean('bgzip_output', fallback=False)
+    compression_threads = allocation_config['FILE'].getint('compression_threads', fallback=1)
+    mapped_translation_map = allocation_config['FILE'].getboolean('mapped_translation_map', fallback=False)
+    if not translation_map_path:
+        sys.exit('Please set translation_map in the FILE section of the allocation config')
+
+    with TranslationMap(translation_map_path) as translation_map:
+        gff_annotation = GFFAnnotations(input_gff_path, output_gff_path, translation_map, bgzip_output,
+                                        compression_threads, mapped_translation_map)
+        gff_annotation.annotate_gff(gff_processes)
@@ -12,52 +12,104 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import argparse
 import configparser
 import sys
 from allocation_service.event_input import GffFilePasser
+from allocation_service.allocation_journal import AllocationJournal
 from allocation_service.annotation_events import EventCollection
 from allocation_service.osid_service import OSIDService
+from allocation_service.run_report import RunReport
+from allocation_service.metrics import REGISTRY
 from allocation_service.event_output import GFFAnnotations, AnnotationEventFile, SessionService
 from session_service.rest_api import DataBaseConnection, AssigningApplication, ProductionDatabase
 
 
 if __name__ == '__main__':
-    allocation_config_file = './allocation_service/allocation_pipeline.conf'
-    session_config_file = './session_service/session_service.conf'
-    allocation_config = configparser.ConfigParser()
-    allocation_config.read(allocation_config_file)
-
-    pipeline_name = allocation_config['PIPELINE']['name']
-    pipeline_version = allocation_config['PIPELINE']['version']
-    commit_message = allocation_config['PIPELINE']['message']
-    input_gff_path = allocation_config['FILE']['input_gff']
-    output_gff_path = allocation_config['FILE']['output_gff']
-    event_file_path = allocation_config['FILE']['event']
-    allowed_gene_models = allocation_config['FILE']['allowed_gene_models']
-    allowed_bio_types = allocation_config['FILE']['allowed_bio_types']
-    organism_production_name = allocation_config['ProductionOrganism']['name']
-    production_database_name = allocation_config['ProductionOrganism']['database']
-
-    event_input = GffFilePasser(input_gff_path, allowed_gene_models, allowed_bio_types)
-    osid_service = OSIDService(allocation_config)
-    event_collection = EventCollection(organism_production_name, event_input, osid_service)
-    event_collection.create()
-
-    session_database = DataBaseConnection(session_config_file)
-    assigning_application = AssigningApplication(session_database)
-    application_id = assigning_application.get(name=pipeline_name, version=pipeline_version)
-    if not application_id:
-        sys.exit('Please add the assigning pipeline to the assigning_application table in the session database')
-    production_database = ProductionDatabase(session_database)
-    production_database_id = production_database.get(name=production_database_name)
-
-    if not production_database_id:
-        production_database_id = production_database.post(name=production_database_name)
-
-    session_service = SessionService(session_database, application_id, production_database_id,
-                                     commit_message, event_collection)
-
-    gff_annotation = GFFAnnotations(input_gff_path, output_gff_path, event_collection)
-    gff_annotation.annotate_gff()
-    event_file = AnnotationEventFile(event_collection, event_file_path)
-    event_file.write_event_file()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--resume', action='store_true',
+                        help='replay the allocation journal of a failed run and skip the calls that succeeded')
+    parser.add_argument('--report', help='write the stage timings and counters of the run to this JSON file')
+    parser.add_argument('--profile', help='write cProfile stats of the run to this file')
+    parser.add_argument('--metrics', help='write the OSID and session database call latencies to this '
+                                          'Prometheus text file')
+    arguments = parser.parse_args()
+    run_report = RunReport(arguments.profile)
+    try:
+        allocation_config_file = './allocation_service/allocation_pipeline.conf'
+        session_config_file = './session_service/session_service.conf'
+        allocation_config = configparser.ConfigParser()
+        allocation_config.read(allocation_config_file)
+
+        pipeline_name = allocation_config['PIPELINE']['name']
+        pipeline_version = allocation_config['PIPELINE']['version']
+        commit_message = allocation_config['PIPELINE']['message']
+        input_gff_path = allocation_config['FILE']['input_gff']
+        output_gff_path = allocation_config['FILE']['output_gff']
+        event_file_path = allocation_config['FILE']['event']
+        allowed_gene_models = allocation_config['FILE']['allowed_gene_models']
+        allowed_bio_types = allocation_config['FILE']['allowed_bio_types']
+        gff_streaming = allocation_config['FILE'].get('gff_streaming', fallback='') or None
+        single_pass_gff = allocation_config['FILE'].getboolean('single_pass_gff', fallback=False)
+        max_concurrency = 1
+        if allocation_config['PIPELINE'].getboolean('concurrent_allocation', fallback=False):
+            max_concurrency = allocation_config['PIPELINE'].getint('max_concurrency', fallback=4)
+        allocation_chunk_size = allocation_config['PIPELINE'].getint('allocation_chunk_size', fallback=0)
+        allocation_chunk_workers = allocation_config['PIPELINE'].getint('allocation_chunk_workers', fallback=1)
+        gff_processes = allocation_config['PIPELINE'].getint('gff_processes', fallback=1)
+        bgzip_output = allocation_config['FILE'].getboolean('bgzip_output', fallback=False)
+        compression_threads = allocation_config['FILE'].getint('compression_threads', fallback=1)
+        translation_map_path = allocation_config['FILE'].get('translation_map', fallback='')
+        journal_path = allocation_config['FILE'].get('journal', fallback='')
+        organism_production_name = allocation_config['ProductionOrganism']['name']
+        production_database_name = allocation_config['ProductionOrganism']['database']
+        if arguments.resume and not journal_path:
+            sys.exit('Please set journal in the FILE section of the allocation config to resume a run')
+        journal = AllocationJournal(journal_path, arguments.resume)
+        run_report.info.update(pipeline=pipeline_name, version=pipeline_version, organism=organism_production_name,
+                               resume=arguments.resume)
+
+        span_feature_types = GFFAnnotations.allowed_feature if single_pass_gff else None
+        with run_report.stage('load_events'):
+            event_input = GffFilePasser(input_gff_path, allowed_gene_models, allowed_bio_types, gff_streaming,
+                                        span_feature_types)
+        osid_service = OSIDService(allocation_config, run_report)
+        event_collection = EventCollection(organism_production_name, event_input, osid_service, max_concurrency,
+                                           allocation_chunk_size, allocation_chunk_workers, journal, run_report)
+        event_collection.create()
+        if translation_map_path:
+            with run_report.stage('translation_map'):
+                event_collection.export_translation_map(translation_map_path)
+
+        session_database = DataBaseConnection(session_config_file, REGISTRY)
+        run_report.count_sql_statements(session_database.engine)
+        assigning_application = AssigningApplication(session_database)
+        application_id = assigning_application.get(name=pipeline_name, version=pipeline_version)
+        if not application_id:
+            sys.exit('Please add the assigning pipeline to the assigning_application table in the session database')
+        production_database = ProductionDatabase(session_database)
+        production_database_id = production_database.get(name=production_database_name)
+
+        if not production_database_id:
+            production_database_id = production_database.post(name=production_database_name)
+
+        with run_report.stage('session_database'):
+            session_service = SessionService(session_database, application_id, production_database_id,
+                                             commit_message, event_collection, journal=journal, report=run_report)
+
+        gff_annotation = GFFAnnotations(input_gff_path, output_gff_path, event_collection, bgzip_output,
+                                        compression_threads)
+        with run_report.stage('gff_rewrite'):
+            if single_pass_gff:
+                gff_annotation.annotate_gff_from_spans(event_input.feature_spans)
+            else:
+                gff_annotation.annotate_gff(gff_processes)
+        with run_report.stage('event_file'):
+            event_file = AnnotationEventFile(event_collection, event_file_path, bgzip_output, compression_threads)
+            event_file.write_event_file()
+        journal.close()
+    finally:
+        run_report.finish(arguments.report)
+        REGISTRY.print_summary()
+        if arguments.metrics:
+            REGISTRY.write_prometheus(arguments.metrics)
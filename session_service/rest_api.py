@@ -13,15 +13,32 @@ limitations under the License.
 """
 
 import configparser
+import functools
 from sqlalchemy.orm import Session as SqlSession
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.automap import automap_base
 from sqlalchemy import create_engine
 
 
+def timed(endpoint):
+    """
+    Decorator for the table calls. When the database connection was given metrics, e.g. the MetricsRegistry
+    of the allocation service, each call is timed with its time_call(system, endpoint, function, *args)
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(self, *args, **kwargs):
+            if self.metrics is None:
+                return function(self, *args, **kwargs)
+            return self.metrics.time_call('session_database', endpoint, function, self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
 class DataBaseConnection:
 
-    def __init__(self, config_file):
+    def __init__(self, config_file, metrics=None):
+        self.metrics = metrics
         config = configparser.ConfigParser()
         config.read(config_file)
         self.db_name = config['DataBase']['db_name']
@@ -43,7 +60,9 @@ class AssigningApplication:
     def __init__(self, database_connection):
         self.assigning_application = database_connection.base.classes.assigning_application
         self.sql_session = SqlSession(database_connection.engine)
+        self.metrics = database_connection.metrics
 
+    @timed('assigning_application.get')
     def get(self, **kwargs):
 
         if 'application_id' in kwargs:
@@ -61,6 +80,7 @@ class AssigningApplication:
         else:
             return False  # 400 Bad Request
 
+    @timed('assigning_application.post')
     def post(self, **kwargs):
         if 'name' in kwargs and 'version' in kwargs and 'description' in kwargs:
             new_application = self.assigning_application(name=kwargs['name'], version=kwargs['version'],
@@ -76,6 +96,7 @@ class AssigningApplication:
         else:
             return False  # 400 Bad Request
 
+    @timed('assigning_application.patch')
     def patch(self, **kwargs):
         if 'application_id' in kwargs and 'description' in kwargs:
             row = self.sql_session.query(self.assigning_application).get(kwargs['application_id'])
@@ -103,7 +124,9 @@ class ProductionDatabase:
     def __init__(self, database_connection):
         self.production_database = database_connection.base.classes.production_database
         self.sql_session = SqlSession(database_connection.engine)
+        self.metrics = database_connection.metrics
 
+    @timed('production_database.get')
     def get(self, **kwargs):
         if 'production_database_id' in kwargs:
             result = self.sql_session.query(self.production_database).get(kwargs['production_database_id'])
@@ -121,6 +144,7 @@ class ProductionDatabase:
         else:
             return False  # 400 Bad Request
 
+    @timed('production_database.post')
     def post(self, **kwargs):
         if 'name' in kwargs:
             new_database = self.production_database(name=kwargs['name'])
@@ -135,6 +159,7 @@ class ProductionDatabase:
         else:
             return False  # 400 Bad Request
 
+    @timed('production_database.patch')
     def patch(self, **kwargs):
         if 'production_database_id' in kwargs and 'name' in kwargs:
 
@@ -163,7 +188,9 @@ class Session:
     def __init__(self, database_connection):
         self.session_table = database_connection.base.classes.session
         self.sql_session = SqlSession(database_connection.engine)
+        self.metrics = database_connection.metrics
 
+    @timed('session.get')
     def get(self, **kwargs):
         if 'session_id' in kwargs:
             result = self.sql_session.query(self.session_table).get(kwargs['session_id'])
@@ -182,6 +209,7 @@ class Session:
         else:
             return False  # 400 Bad Request
 
+    @timed('session.post')
     def post(self, **kwargs):
         if 'application_id' in kwargs and 'production_database_id' in kwargs and 'osid_idsetid' in kwargs\
                 and 'message' in kwargs:
@@ -199,6 +227,7 @@ class Session:
         else:
             return False  # '400 Bad Request'
 
+    @timed('session.patch')
     def patch(self, **kwargs):
         if kwargs['session_id'] and kwargs['data_check']:
             row = self.sql_session.query(self.session_table).get(kwargs['session_id'])
@@ -223,10 +252,12 @@ class SessionIdentifierAction:
     def __init__(self, database_connection):
         self.session_identifier_action = database_connection.base.classes.session_identifier_action
         self.sql_session = SqlSession(database_connection.engine)
+        self.metrics = database_connection.metrics
 
     def __del__(self):
         self.sql_session.close()
 
+    @timed('session_identifier_action.get')
     def get(self, **kwargs):
         if 'session_identifier_action_id' in kwargs:
             result = self.sql_session.query(self.session_identifier_action).get(kwargs['session_identifier_action_id'])
@@ -234,6 +265,7 @@ class SessionIdentifierAction:
         else:
             return False  # 400 Bad Request
 
+    @timed('session_identifier_action.post')
     def post(self, **kwargs):
         if 'stable_identifier_record_id' in kwargs and 'session_id' in kwargs and 'action' in kwargs:
             new_session_identifier_action = self.session_identifier_action(
@@ -251,6 +283,42 @@ class SessionIdentifierAction:
         else:
             return False  # 400 Bad Request
 
+    @timed('session_identifier_action.post_many')
+    def post_many(self, rows):
+        """
+        Insert many actions with one executemany in a single transaction.
+        Actions of a record in a session that already exist are skipped
+        """
+        new_rows = list()
+        for row in rows:
+            if 'stable_identifier_record_id' in row and 'session_id' in row and 'action' in row:
+                new_rows.append({'sia_stable_identifier_record_id': row['stable_identifier_record_id'],
+                                 'sia_session_id': row['session_id'], 'action': row['action']})
+            else:
+                return False  # 400 Bad Request
+        if not new_rows:
+            return True
+        try:
+            existing = self._get_record_sessions(new_rows)
+            new_rows = [row for row in new_rows
+                        if (row['sia_stable_identifier_record_id'], row['sia_session_id']) not in existing]
+            if new_rows:
+                self.sql_session.execute(self.session_identifier_action.__table__.insert(), new_rows)
+            self.sql_session.commit()
+        except SQLAlchemyError as mysql_error:
+            print(mysql_error.__str__())
+            self.sql_session.rollback()
+            return False
+        return True
+
+    def _get_record_sessions(self, rows):
+        record_ids = {row['sia_stable_identifier_record_id'] for row in rows}
+        result = self.sql_session.query(self.session_identifier_action.sia_stable_identifier_record_id,
+                                        self.session_identifier_action.sia_session_id)\
+            .filter(self.session_identifier_action.sia_stable_identifier_record_id.in_(record_ids))
+        return {(record_id, session_id) for record_id, session_id in result}
+
+    @timed('session_identifier_action.patch')
     def patch(self, **kwargs):
         if 'session_identifier_action_id' in kwargs and 'action' in kwargs:
             row = self.sql_session.query(self.session_identifier_action).get(kwargs['session_identifier_action_id'])
@@ -275,10 +343,12 @@ class StableIdentifierRecord:
     def __init__(self, database_connection):
         self.stable_identifier_record = database_connection.base.classes.stable_identifier_record
         self.sql_session = SqlSession(database_connection.engine)
+        self.metrics = database_connection.metrics
 
     def __del__(self):
         self.sql_session.close()
 
+    @timed('stable_identifier_record.get')
     def get(self, **kwargs):
         if 'stable_identifier_record_id' in kwargs:
             result = self.sql_session.query(self.stable_identifier_record).get(kwargs['stable_identifier_record_id'])
@@ -286,6 +356,7 @@ class StableIdentifierRecord:
         else:
             return False  # 400 Bad Request
 
+    @timed('stable_identifier_record.post')
     def post(self, **kwargs):
         if 'stable_identifier' in kwargs and 'status' in kwargs and 'feature_type' in kwargs:
             new_stable_identifier_record = self.stable_identifier_record(stable_identifier=kwargs['stable_identifier'],
@@ -302,6 +373,49 @@ class StableIdentifierRecord:
         else:
             return False  # 400 Bad Request
 
+    @timed('stable_identifier_record.post_many')
+    def post_many(self, rows):
+        """
+        Insert many records with one executemany in a single transaction.
+        Records that already exist are skipped, returns a dict of stable identifier to the new record id
+        """
+        for row in rows:
+            if not ('stable_identifier' in row and 'status' in row and 'feature_type' in row):
+                return False  # 400 Bad Request
+        try:
+            existing = self._get_record_ids(rows)
+            new_rows = list()
+            for row in rows:
+                if (row['stable_identifier'], row['status']) not in existing:
+                    existing[(row['stable_identifier'], row['status'])] = None
+                    new_rows.append({'stable_identifier': row['stable_identifier'], 'status': row['status'],
+                                     'feature_type': row['feature_type']})
+            if new_rows:
+                self.sql_session.execute(self.stable_identifier_record.__table__.insert(), new_rows)
+            record_ids = self._get_record_ids(new_rows)
+            self.sql_session.commit()
+        except SQLAlchemyError as mysql_error:
+            print(mysql_error.__str__())
+            self.sql_session.rollback()
+            return False
+        return {stable_identifier: record_id for (stable_identifier, _), record_id in record_ids.items()}
+
+    def _get_record_ids(self, rows):
+        if not rows:
+            return dict()
+        record_ids = dict()
+        identifiers = {row['stable_identifier'] for row in rows}
+        wanted = {(row['stable_identifier'], row['status']) for row in rows}
+        result = self.sql_session.query(self.stable_identifier_record.stable_identifier,
+                                        self.stable_identifier_record.status,
+                                        self.stable_identifier_record.stable_identifier_record_id)\
+            .filter(self.stable_identifier_record.stable_identifier.in_(identifiers))
+        for stable_identifier, status, record_id in result:
+            if (stable_identifier, status) in wanted:
+                record_ids[(stable_identifier, status)] = record_id
+        return record_ids
+
+    @timed('stable_identifier_record.patch')
     def patch(self, **kwargs):
         if 'stable_identifier_record_id' in kwargs and 'status' in kwargs:
             row = self.sql_session.query(self.stable_identifier_record).get(kwargs['stable_identifier_record_id'])
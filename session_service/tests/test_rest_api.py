@@ -107,6 +107,43 @@ class RestTestCase(unittest.TestCase):
         result_2 = stable_identifier_record.delete()
         self.assertEqual(False, result_2)
 
+    def test_StableIdentifierRecord_post_many(self):
+        stable_identifier_record = rest_api.StableIdentifierRecord(self.connection)
+        _ = stable_identifier_record.post(stable_identifier='AGAP000010', status='current', feature_type='gene')
+        record_ids = stable_identifier_record.post_many([
+            {'stable_identifier': 'AGAP000010', 'status': 'current', 'feature_type': 'gene'},
+            {'stable_identifier': 'AGAP000011', 'status': 'current', 'feature_type': 'gene'},
+            {'stable_identifier': 'AGAP000011-RA', 'status': 'current', 'feature_type': 'transcript'}])
+        self.assertEqual({'AGAP000011', 'AGAP000011-RA'}, set(record_ids))
+        stable_identifier, status, feature_type = stable_identifier_record.get(
+            stable_identifier_record_id=record_ids['AGAP000011-RA'])
+        self.assertEqual(('AGAP000011-RA', 'current', 'transcript'), (stable_identifier, status, feature_type))
+        result_1 = stable_identifier_record.post_many([{'stable_identifier': 'AGAP000012'}])
+        self.assertEqual(False, result_1)
+
+    def test_session_identifier_action_post_many(self):
+        stable_identifier_record = rest_api.StableIdentifierRecord(self.connection)
+        record_ids = stable_identifier_record.post_many([
+            {'stable_identifier': 'AGAP000020', 'status': 'current', 'feature_type': 'gene'},
+            {'stable_identifier': 'AGAP000021', 'status': 'current', 'feature_type': 'gene'}])
+        assigning_application = rest_api.AssigningApplication(self.connection)
+        application_id = assigning_application.post(name='test_application_06', version=1, description='this is a test application')
+        production_database = rest_api.ProductionDatabase(self.connection)
+        production_database_id = production_database.post(name='core_test_database_06')
+        session_table = rest_api.Session(self.connection)
+        session_id = session_table.post(application_id=application_id, production_database_id=production_database_id, osid_idsetid=20, message="this is a bulk action test")
+        session_identifier_action = rest_api.SessionIdentifierAction(self.connection)
+        result_1 = session_identifier_action.post_many([
+            {'stable_identifier_record_id': record_id, 'session_id': session_id, 'action': 'create'}
+            for record_id in record_ids.values()])
+        self.assertEqual(True, result_1)
+        result_2 = session_identifier_action.post_many([
+            {'stable_identifier_record_id': record_id, 'session_id': session_id, 'action': 'create'}
+            for record_id in record_ids.values()])
+        self.assertEqual(True, result_2)
+        result_3 = session_identifier_action.post_many([{'stable_identifier_record_id': 1, 'session_id': session_id}])
+        self.assertEqual(False, result_3)
+
     def test_session_identifier_action(self):
         session_identifier_action = rest_api.SessionIdentifierAction(self.connection)
         stable_identifier_record = rest_api.StableIdentifierRecord(self.connection)